@@ -1,15 +1,55 @@
 import os
 import argparse
 import re
-import pypandoc
 import json
+import time
+import traceback
+import cProfile
+import pstats
+import concurrent.futures
+from scripts.bibliography import Bibliography
+from scripts.build_manifest import BuildManifest, hash_text
+from scripts.build_timing import collect_timings, get_build_timer, timed
+from scripts.convert_markdown import (
+    convert_markdown_to_html,
+    ensure_pandoc_pool,
+    start_pandoc_pool,
+    stop_pandoc_pool,
+)
 from scripts.create_page_index import update_page_index
+from scripts.content_model import SITE_URL_PREFIX, ContentModel
 from scripts.create_navbar import generate_navbar_html
+from scripts.dev_server import (
+    DevServer,
+    get_changed_files,
+    get_watched_files,
+)
 from scripts.convert_notebooks import convert_notebooks_to_html
+from scripts.kernel_pool import shutdown_kernel_pool
+from scripts.notebook_scheduler import get_machine_resources
+from scripts.notebook_sections import NotebookSectionStore
+from scripts.output_files import (
+    count_outputs,
+    get_output_counter,
+    write_if_changed,
+)
+from scripts.search_index import build_search_index, save_search_document
+from scripts.shared_assets import (
+    ASSETS_PATH_PLACEHOLDER,
+    NAVBAR_ASSET_NAME,
+    write_shared_assets,
+)
+from scripts.stat_cache import StatCache
+from scripts.static_assets import build_static_site
 
 
-def compile_page_components():
-    """Compile base html components for building webpage"""
+def compile_page_components(
+        content_model=None,
+        search=False,
+        ):
+    """Compile base html components for building webpage, optionally with
+    the search box in the topbar. Also returns the 'links' and 'titles'
+    of the pages in navbar order."""
 
     templates_folder = os.path.join(os.getcwd(), 'templates')
     templates = ['header', 'topbar', 'footer', 'script']
@@ -20,268 +60,611 @@ def compile_page_components():
         with open(templates_path, 'r') as f:
             html_parts[template] = f.read()
 
-    update_page_index()
-    navbar_html, ordered_links = generate_navbar_html()
+    if search:
+        with open(os.path.join(templates_folder, 'search.html'), 'r') as f:
+            search_html = f.read()
+        html_parts['topbar'] = html_parts['topbar'].replace(
+            '        <!-- Right side of topbar -->',
+            search_html + '        <!-- Right side of topbar -->',
+            1,
+        )
+
+    if content_model is None:
+        content_model = ContentModel()
+
+    with timed('page index'):
+        update_page_index(content_model)
+    with timed('navbar'):
+        navbar_html, ordered_page_links = generate_navbar_html(
+            content_model
+        )
     html_parts['navbar'] = navbar_html
 
-    return html_parts, ordered_links
+    return html_parts, ordered_page_links
 
 
 def get_page_paths(path=None):
     """Get paths to all .md pages to be converted to html"""
+    return ContentModel(path).get_page_paths()
 
-    md_pages = {}
-    if path is None:
-        path = os.path.join(os.getcwd(), "content")
-    directories = os.listdir(path)
-    for item in directories:
-        item_path = os.path.join(path, item)
-        if os.path.isdir(item_path):
-            # add items from new dict into md_pages
-            md_pages.update(get_page_paths(item_path))
-        else:
-            if not item == "README.md" and item.endswith(".md"):
-                md_pages[item] = item_path
 
-    return md_pages
+def get_page_link(out_path):
+    """Get the site link of an output .html file, as used in the
+    navbar"""
+    relative_path = os.path.relpath(out_path, os.getcwd())
+    return SITE_URL_PREFIX + relative_path.replace(os.sep, '/')
 
 
-def generate_page_html(page_paths):
+def get_footer_links(
+        ordered_links,
+        ordered_titles,
+        ):
     """
+    Map each page link to the links and titles of the previous and next
+    pages in the navbar order
+
+    Arguments
+    ---------
+    ordered_links : list of str
+        Page links in navbar order
+    ordered_titles : list of str
+        Page titles in navbar order
+
+    Returns
+    -------
+    footer_links : dict
+        Mapping of page links to (prev_page, prev_title, next_page,
+        next_title), with "None" links at either end
     """
+    footer_links = {}
+    last_page = len(ordered_links) - 1
+    for location, link in enumerate(ordered_links):
+        if location == 0:
+            prev_page = "None"
+            prev_title = ""
+        else:
+            prev_page = ordered_links[location-1]
+            prev_title = ordered_titles[location-1]
+        if location == last_page:
+            next_page = "None"
+            next_title = "None"
+        else:
+            next_page = ordered_links[location+1]
+            next_title = ordered_titles[location+1]
+        footer_links[link] = (prev_page, prev_title, next_page, next_title)
+    return footer_links
 
-    # get the .html templates for building pages
-    html_parts, ordered_links = compile_page_components()
-
-    # specify the order of components for assembling pages
-    order = [
-        'header',
-        'navbar',
-        'topbar',
-        'body',
-        'footer',
-        'script',
+
+def get_page_input_hashes(
+        manifest,
+        html_parts,
+        search=False,
+        ):
+    """Hash the inputs shared by every page: the templates and the
+    navbar generated from index.json, or the tags loading them from
+    shared assets"""
+
+    templates_folder = os.path.join(os.getcwd(), 'templates')
+    template_files = [
+        'header.html',
+        'topbar.html',
+        'footer.html',
+        'script.html',
+        'md_yaml_metadata.txt',
     ]
+    if search:
+        template_files.append('search.html')
 
-    # print(ordered_links)
+    input_hashes = {}
+    for template_file in template_files:
+        input_hashes[f'templates/{template_file}'] = manifest.hash_file(
+            os.path.join(templates_folder, template_file)
+        )
+    input_hashes['navbar'] = hash_text(html_parts['navbar'])
+    input_hashes['script'] = hash_text(html_parts['script'])
 
-    for md_page, path in page_paths.items():
-        page_components = html_parts.copy()
+    return input_hashes
 
-        # get the directory containing the markdown file
-        out_directory = path.split(md_page)[0]
 
-        # remove leading `##_` from page and change extension to .html
-        html_page = md_page.split("_", 1)[1]
-        html_page = html_page.split(".md")[0] + ".html"
+# specify the order of components for assembling pages
+PAGE_ORDER = [
+    'header',
+    'navbar',
+    'topbar',
+    'body',
+    'footer',
+    'script',
+]
 
-        # set the output path
-        out_path = out_directory + html_page
+# folders and files of the root that are served by the site and
+# published by --dist
+PUBLISHED_PATHS = [('content',)]
 
-        # update 'header' page_component with the relative stylesheet path
-        # ------------------------------------------------------------
-        # set the path from root directory to the stylesheet
-        css_path = os.path.join(
-            os.getcwd(),
-            "content",
-            "assets",
-            "styles.css"
-        )
-        # get the relative path
-        relative_css_path = os.path.relpath(
-            css_path,
-            start=out_directory
-        )
-        # update the 'header' page_component with the correct path
-        page_components['header'] = page_components['header'].replace(
-            '<link rel="stylesheet" href="styles.css">',
-            f'<link rel="stylesheet" href="{relative_css_path}">'
-        )
+# folder of the shared navbar and script assets, relative to the root
+SHARED_ASSETS_FOLDER = ('content', 'assets', 'shared')
 
-        # update 'footer' page_component with the correct links
-        # ------------------------------------------------------------
-        footer_path = os.path.join(
-            os.getcwd(),
-            'templates',
-            'ordered_page_links.json'
-        )
+# folder of the figures of notebook outputs, relative to the content folder
+NOTEBOOK_IMAGES_FOLDER = ('assets', 'notebook_images')
 
-        with open(footer_path, 'r') as f:
-            ordered_page_links = json.load(f)
+# folder of the search index, relative to the root; content/assets/search.js
+# loads the index from this location
+SEARCH_INDEX_FOLDER = ('content', 'assets', 'search')
 
-        ordered_links = ordered_page_links['links']
-        ordered_titles = ordered_page_links['titles']
+# page components shared with worker processes when rendering in parallel
+_shared_html_parts = None
 
-        location = None
-        last_page = len(ordered_links)-1
-        for i, link in enumerate(ordered_links):
-            # print(f'{link} | {out_path}')
-            if link in out_path:
-                location = i
-        if location == 0:
-            prev_page = "None"
-            prev_title = ""
-            next_page = ordered_links[location+1]
-            next_title = ordered_titles[location+1]
-        elif location == last_page:
-            prev_page = ordered_links[location-1]
-            prev_title = ordered_titles[location-1]
-            next_page = "None"
-            next_title = "None"
+# parsed notebook .json outputs, shared by the pages rendered in a process
+_notebook_sections = NotebookSectionStore()
+
+
+def _set_shared_html_parts(html_parts):
+    """Initializer for page rendering worker processes"""
+    global _shared_html_parts
+    _shared_html_parts = html_parts
+
+
+def get_html_from_json(
+        nb_name,
+        nb_path,
+        start=None,
+        end=None,
+        ):
+    """Get the structured .json output for a specified
+    .ipynb notebook, extract the relevent html components,
+    and return the aggregated html as a string.
+
+    Arguments
+    ---------
+    nb_name : str
+        Jupyter notebook file name
+        E.g., 'simulate_erps.ipynb'
+    nb_path : str
+        Path to notebook
+        E.g.: 'website/content/erps/simulate_erps.ipynb'
+    start : str | None
+        Title of the first section to include
+    end : str | None
+        Title of the last section to include; see
+        NotebookSections.get_html
+
+    Returns
+    -------
+    agg_html : str
+    """
+    json_path = nb_path.split('.ipynb')[0] + '.json'
+    sections = _notebook_sections.get(nb_name, json_path)
+    return sections.get_html(start, end)
+
+
+def add_notebook_to_html(
+        converted_html,
+        out_directory,
+        ):
+    """
+    Function to insert Jupyter notebook html outputs into html
+    pages converted from markdown files
+
+    A line with "[[notebook.ipynb]]" is replaced by the whole notebook,
+    "[[notebook.ipynb][start]]" by the section titled start and its
+    subsections, and "[[notebook.ipynb][start][end]]" by the sections
+    from start through end
+
+    Arguments
+    ---------
+    converted_html : str
+    out_directory : str
+        Directory containing the markdown file and its notebooks
+
+    Returns
+    -------
+    combined_html : str
+    """
+    # regex pattern match for "[[notebook_name.ipynb]" followed by
+    # optional "[section title]" arguments and a closing bracket
+    nb_match_pattern = re.compile(
+        r"\[\[(.+?\.ipynb)\]((?:\[[^\[\]]*\])*)\]"
+    )
+    nb_arguments_pattern = re.compile(r"\[([^\[\]]*)\]")
+
+    # pandoc wraps long lines, so join notebook specifications that
+    # were split over several lines
+    converted_html = nb_match_pattern.sub(
+        lambda match: " ".join(match.group(0).split()),
+        converted_html,
+    )
+
+    output_lines = []
+    for line in converted_html.splitlines():
+        match = nb_match_pattern.search(line)
+
+        if match:
+            notebook_name = match.group(1)
+            nb_path = out_directory + notebook_name
+            args = nb_arguments_pattern.findall(match.group(2))
+            if len(args) > 2:
+                raise ValueError(
+                    f"Too many arguments in notebook specification"
+                    f" '{match.group(0)}'; expected"
+                    " [[notebook.ipynb][start][end]]"
+                )
+            notebook_html = get_html_from_json(
+                notebook_name,
+                nb_path,
+                *args,
+            )
+            output_lines.append(notebook_html)
         else:
-            prev_page = ordered_links[location-1]
-            prev_title = ordered_titles[location-1]
-            next_page = ordered_links[location+1]
-            next_title = ordered_titles[location+1]
+            output_lines.append(line)
+
+    combined_html = "\n".join(output_lines)
+    return combined_html
+
+
+def render_page(
+        page,
+        html_parts=None,
+        ):
+    """
+    Convert a single markdown page to html and write it to its output
+    path. This is a top-level function so that pages can be rendered in
+    worker processes.
+
+    Arguments
+    ---------
+    page : dict
+        Page description from generate_page_html, with the markdown
+        text, bibliography, output path and prev/next links
+    html_parts : dict | None
+        The html templates and navbar; defaults to the components shared
+        with the worker process
 
-        page_components['footer'] = page_components['footer'].replace(
-            '<div class="previous-area" data-link="None">',
-            f'<div class="previous-area" data-link="{prev_page}">'
+    Returns
+    -------
+    timings : dict
+        Time spent in each build stage while rendering the page, in
+        seconds
+    outputs : OutputCounter
+        Whether the page was written or was unchanged
+    """
+    with collect_timings() as page_timer, count_outputs() as outputs:
+        with timed('page assembly'):
+            _render_page(page, html_parts)
+    return dict(page_timer.stages), outputs
+
+
+def _render_page(
+        page,
+        html_parts=None,
+        ):
+    """Render a single page; see render_page"""
+    if html_parts is None:
+        html_parts = _shared_html_parts
+    page_components = html_parts.copy()
+
+    out_directory = page['out_directory']
+
+    # update 'header' page_component with the relative stylesheet path
+    # ------------------------------------------------------------
+    # set the path from root directory to the stylesheet
+    css_path = os.path.join(
+        os.getcwd(),
+        "content",
+        "assets",
+        "styles.css"
+    )
+    # get the relative path
+    relative_css_path = os.path.relpath(
+        css_path,
+        start=out_directory
+    )
+    # update the 'header' page_component with the correct path
+    page_components['header'] = page_components['header'].replace(
+        '<link rel="stylesheet" href="styles.css">',
+        f'<link rel="stylesheet" href="{relative_css_path}">'
+    )
+
+    # point shared asset tags to the assets folder
+    # ------------------------------------------------------------
+    relative_assets_path = os.path.relpath(
+        os.path.join(os.getcwd(), *SHARED_ASSETS_FOLDER),
+        start=out_directory
+    )
+    for section in ('navbar', 'script'):
+        page_components[section] = page_components[section].replace(
+            ASSETS_PATH_PLACEHOLDER,
+            relative_assets_path.replace(os.sep, '/'),
         )
-        page_components['footer'] = page_components['footer'].replace(
-            '<div class="next-area" data-link="None">',
-            f'<div class="next-area" data-link="{next_page}">'
+
+    # update 'footer' page_component with the correct links
+    # ------------------------------------------------------------
+    page_components['footer'] = page_components['footer'].replace(
+        '<div class="previous-area" data-link="None">',
+        f'<div class="previous-area" data-link="{page["prev_page"]}">'
+    )
+    page_components['footer'] = page_components['footer'].replace(
+        '<div class="next-area" data-link="None">',
+        f'<div class="next-area" data-link="{page["next_page"]}">'
+    )
+
+    page_components['footer'] = page_components['footer'].replace(
+        '<a>PreviousTitle</a>',
+        f'<a>{page["prev_title"]}</a>'
+    )
+    page_components['footer'] = page_components['footer'].replace(
+        '<a>NextTitle</a>',
+        f'<a>{page["next_title"]}</a>'
+    )
+
+    # convert markdown to html with pandoc, processing citations only
+    # for pages that cite the bibliography
+    # ------------------------------------------------------------
+    with timed('pandoc conversion'):
+        converted_html = convert_markdown_to_html(
+            page['markdown_text'],
+            bibliography=page['bibliography'],
+        )
+
+    # optionally add Jupyter notebook ouptuts to converted html
+    # ------------------------------------------------------------
+    with timed('notebook splicing'):
+        combined_html = add_notebook_to_html(converted_html, out_directory)
+
+    # save the searchable text of the page for the search index
+    # ------------------------------------------------------------
+    if page.get('search_document_path'):
+        with timed('search indexing'):
+            save_search_document(
+                page['search_document_path'],
+                page['link'],
+                page['title'],
+                combined_html,
+            )
+
+    # Aggregate all page components and write output
+    # ------------------------------------------------------------
+    page_components['body'] = combined_html
+
+    file_contents = ""
+    for section in PAGE_ORDER:
+        file_contents += page_components[section]
+    file_contents += '\n</body>\n</html>'
+
+    with timed('writes'):
+        write_if_changed(page['out_path'], file_contents)
+
+
+def generate_page_html(
+        page_paths,
+        manifest=None,
+        jobs=1,
+        bibliography=None,
+        content_model=None,
+        asset_mode='inline',
+        search_folder=None,
+        ):
+    """
+    Convert markdown pages to html and assemble them with the templates
+
+    Arguments
+    ---------
+    page_paths : dict
+        Mapping of markdown file names to their paths
+    bibliography : Bibliography | None
+        The parsed textbook bibliography. It is loaded from
+        textbook-bibliography.bib if not provided.
+    manifest : BuildManifest | None
+        If provided, pages whose inputs are unchanged since the last
+        build are skipped
+    jobs : int
+        Number of worker processes used to render pages. Pages are
+        rendered serially when jobs is 1.
+    content_model : ContentModel | None
+        The scanned content folder used for the page index and navbar;
+        content/ is scanned if not provided
+    asset_mode : str
+        'inline' to include the navbar and scripts in every page, or
+        'shared' to load them from shared .js assets that browsers cache
+        across pages (see write_shared_assets)
+    search_folder : str | None
+        If provided, the text of each rendered page is saved to this
+        folder, a search box is added to the topbar, and the search index
+        is built from the saved text of all pages (see build_search_index)
+    """
+    if content_model is None:
+        content_model = ContentModel()
+    search = search_folder is not None
+
+    # reload notebook outputs that were converted since the last build
+    _notebook_sections.clear()
+
+    # get the .html templates for building pages
+    html_parts, ordered_page_links = compile_page_components(
+        content_model,
+        search=search,
+    )
+    if asset_mode == 'shared':
+        html_parts = write_shared_assets(
+            html_parts,
+            os.path.join(os.getcwd(), *SHARED_ASSETS_FOLDER),
         )
 
-        page_components['footer'] = page_components['footer'].replace(
-            '<a>PreviousTitle</a>',
-            f'<a>{prev_title}</a>'
+    if manifest is not None:
+        shared_input_hashes = get_page_input_hashes(
+            manifest,
+            html_parts,
+            search=search,
         )
-        page_components['footer'] = page_components['footer'].replace(
-            '<a>NextTitle</a>',
-            f'<a>{next_title}</a>'
+
+    if bibliography is None:
+        bibliography = Bibliography(
+            os.path.join(os.getcwd(), 'textbook-bibliography.bib'),
+            cache_folder=os.path.join(os.getcwd(), '.build_cache'),
         )
 
+    path_md_yaml_metadata = os.path.join(
+        os.getcwd(),
+        'templates',
+        'md_yaml_metadata.txt',
+    )
+    with open(path_md_yaml_metadata) as f:
+        md_yaml_metadata = f.read()
+
+    # map each page to its previous and next pages
+    footer_links = get_footer_links(
+        ordered_page_links['links'],
+        ordered_page_links['titles'],
+    )
+
+    page_titles = {page.link: page.title for page in content_model.pages}
+
+    # collect the pages that need to be rendered
+    pages = []
+    search_document_paths = []
+    for md_page, path in page_paths.items():
+        # get the directory containing the markdown file
+        out_directory = path.split(md_page)[0]
+
+        # remove leading `##_` from page and change extension to .html
+        html_page = md_page.split("_", 1)[1]
+        html_page = html_page.split(".md")[0] + ".html"
+
+        # set the output path
+        out_path = out_directory + html_page
+        relative_out_path = os.path.relpath(out_path)
+
+        # get the previous and next pages for the footer
+        # ------------------------------------------------------------
+        page_link = get_page_link(out_path)
+        if page_link not in footer_links:
+            raise ValueError(
+                f"Page '{relative_out_path}' is not listed in index.json;"
+                " make sure that its folder contains a README.md with a"
+                " title"
+            )
+        prev_page, prev_title, next_page, next_title = \
+            footer_links[page_link]
+
         # load markdown and add yaml metadata
         # ------------------------------------------------------------
         # read markdown file into a string
         with open(path, "r", encoding="utf-8") as f:
             markdown_text = f.read()
 
-        path_md_yaml_metadata = os.path.join(
-            os.getcwd(),
-            'templates',
-            'md_yaml_metadata.txt',
-        )
-        with open(path_md_yaml_metadata) as f:
-            md_yaml_metadata = f.read()
-
         # add check for title section in markdown file
 
-        markdown_text = markdown_text.replace(
+        page_markdown_text = markdown_text.replace(
             '-->',
             '-->\n\n'+md_yaml_metadata,
             1
         )
 
-        # convert markdown to html with pypandoc
-        # ------------------------------------------------------------
-        converted_html = pypandoc.convert_text(
-            markdown_text,
-            format='md',
-            to='html',
-            extra_args=[
-                "--bibliography=textbook-bibliography.bib",
-                "--citeproc",
-                "--mathml",
-                "-f",
-                "markdown-auto_identifiers",
-            ],
-        )
+        # get a bibliography with only the entries cited by this page
+        with timed('bibliography', item=relative_out_path):
+            page_bibliography = bibliography.get_page_bibliography(
+                page_markdown_text
+            )
 
-        # optionally add Jupyter notebook ouptuts to converted html
-        # ------------------------------------------------------------
+        page = {
+            'out_directory': out_directory,
+            'out_path': out_path,
+            'markdown_text': page_markdown_text,
+            'bibliography': page_bibliography,
+            'prev_page': prev_page,
+            'prev_title': prev_title,
+            'next_page': next_page,
+            'next_title': next_title,
+        }
+        extra_outputs = []
+        if search:
+            page['link'] = page_link
+            page['title'] = page_titles.get(page_link, 'NA')
+            page['search_document_path'] = os.path.join(
+                search_folder,
+                hash_text(relative_out_path)[:16] + '.json',
+            )
+            search_document_paths.append(page['search_document_path'])
+            extra_outputs.append(page['search_document_path'])
 
-        def get_html_from_json(
-                nb_name,
-                nb_path,
+        # skip pages whose inputs have not changed since the last build
+        # ------------------------------------------------------------
+        if manifest is not None:
+            with timed('change detection', item=relative_out_path):
+                input_hashes = {
+                    **shared_input_hashes,
+                    'markdown': hash_text(markdown_text),
+                    'bibliography': (
+                        manifest.hash_file(page_bibliography)
+                        if page_bibliography else None
+                    ),
+                    'page_links': hash_text(json.dumps(
+                        [prev_page, prev_title, next_page, next_title]
+                    )),
+                }
+                # include the .json outputs of embedded notebooks
+                for notebook_name in re.findall(
+                    r"\[\[(.+?\.ipynb)\]",
+                    markdown_text,
                 ):
-            """Get the structured .json output for a specified
-            .ipynb notebook, extract the relevent html components,
-            and return the aggregated html as a string.
-
-            Arguments
-            ---------
-            nb_name : str
-                Jupyter notebook file name
-                E.g., 'simulate_erps.ipynb'
-            nb_path : str
-                Path to notebook
-                E.g.: 'website/content/erps/simulate_erps.ipynb'
-
-            Returns
-            -------
-            agg_html : str
-            """
-            json_path = nb_path.split('.ipynb')[0] + '.json'
-            with open(json_path, 'r') as file:
-                nb_outputs = json.load(file)
-                nb_outputs = nb_outputs.get(nb_name, {})
-                agg_html = ''
-                for section, content in nb_outputs.items():
-                    if isinstance(content, dict) and 'html' in content:
-                        agg_html += content['html']
-            return agg_html
-
-        def add_notebook_to_html(converted_html):
-            """
-            Function to insert Jupyter notebook html outputs into html
-            pages converted from markdown files
-
-            Arguments
-            ---------
-            converted_html : str
-
-            Returns
-            -------
-            combined_html : str
-            """
-            # regex pattern match for "[[notebook_name.ipynb]" with only
-            # a single closing bracket, as additional parameters may be
-            # included in the notebook specification line
-            nb_match_pattern = re.compile(r"\[\[(.+?\.ipynb)\]")
-            # notebook specifications with additional arguments will
-            # match the exact pattern ".ipynb][" as defined below
-            nb_arguments_pattern = ".ipynb]["
-
-            output_lines = []
-            for line in converted_html.splitlines():
-                match = nb_match_pattern.search(line)
-                args = nb_arguments_pattern in line
-
-                if match and args:
-                    notebook_name = match.group(1)
-                    nb_path = path.split(md_page)[0] + notebook_name
-                    print(f'nb with args found: {line}')
-                    print(
-                        'Argument handling will be added in a '
-                        'future update'
+                    json_path = out_directory + \
+                        notebook_name.split('.ipynb')[0] + '.json'
+                    input_hashes[notebook_name] = (
+                        manifest.hash_file(json_path)
+                        if os.path.exists(json_path) else None
                     )
-                    output_lines.append(line)
-                elif match:
-                    notebook_name = match.group(1)
-                    nb_path = path.split(md_page)[0] + notebook_name
-                    notebook_html = get_html_from_json(notebook_name, nb_path)
-                    output_lines.append(notebook_html)
-                else:
-                    output_lines.append(line)
 
-            combined_html = "\n".join(output_lines)
-            return combined_html
+            if manifest.is_up_to_date(out_path, input_hashes, extra_outputs):
+                continue
+            page['input_hashes'] = input_hashes
 
-        combined_html = add_notebook_to_html(converted_html)
+        pages.append(page)
 
-        # Aggregate all page components and write output
-        # ------------------------------------------------------------
-        page_components['body'] = combined_html
+    # render pages, optionally in parallel
+    # ------------------------------------------------------------
+    if jobs > 1 and len(pages) > 1:
+        # start pandoc before forking, so that the workers share it
+        ensure_pandoc_pool()
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_set_shared_html_parts,
+            initargs=(html_parts,),
+        ) as pool:
+            page_results = list(pool.map(render_page, pages))
+    else:
+        page_results = [
+            render_page(page, html_parts)
+            for page in pages
+        ]
 
-        file_contents = ""
-        for section in order:
-            file_contents += page_components[section]
-        file_contents += '\n</body>\n</html>'
+    print()
+    for page, (timings, outputs) in zip(pages, page_results):
+        relative_out_path = os.path.relpath(page['out_path'])
+        get_build_timer().merge(timings, item=relative_out_path)
+        get_output_counter().merge(outputs)
+        print(
+            f"Rendered {relative_out_path}"
+            f" in {sum(timings.values()):.2f}s"
+            + ("" if outputs.changed else " (unchanged)")
+        )
+        if manifest is not None:
+            manifest.record(page['out_path'], page['input_hashes'])
+
+    print(
+        f"\nGenerated {len(pages)} html pages"
+        f" ({len(page_paths) - len(pages)} unchanged)"
+    )
 
-        with open(out_path, 'w') as out:
-            out.write(file_contents)
+    # build the search index from the saved text of every page
+    # ------------------------------------------------------------
+    if search:
+        with timed('search index'):
+            n_changed = build_search_index(
+                search_document_paths,
+                os.path.join(os.getcwd(), *SEARCH_INDEX_FOLDER),
+            )
+        print(
+            f"Indexed {len(search_document_paths)} pages for search"
+            f" ({n_changed} index files changed)"
+        )
 
     return
 
@@ -300,20 +683,388 @@ def main():
         action="store_true",
         help="Execute notebooks before converting them to HTML."
     )
+    parser.add_argument(
+        "--pandoc-workers",
+        type=int,
+        default=2,
+        help=(
+            "Number of long-lived pandoc server processes used for"
+            " markdown conversion. Use 0 to launch one pandoc process"
+            " per conversion."
+        ),
+    )
+    parser.add_argument(
+        "--fresh-kernels",
+        action="store_true",
+        help=(
+            "Execute every notebook in a new kernel instead of reusing warm"
+            " kernels with the common modules already imported. Notebooks"
+            " listed under 'fresh_kernel' in scripts/notebooks_to_skip.json"
+            " always get a new kernel."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help=(
+            "Number of notebooks to execute and pages to render"
+            " concurrently."
+        ),
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        help=(
+            "Cores that notebooks executed in parallel may use in total,"
+            " counting the workers they start as declared in"
+            " scripts/notebook_resources.json. Defaults to all cores."
+        ),
+    )
+    parser.add_argument(
+        "--memory-gb",
+        type=float,
+        default=None,
+        help=(
+            "Memory in GB that notebooks executed in parallel may use in"
+            " total. Defaults to the memory of the machine."
+        ),
+    )
+    parser.add_argument(
+        "--cell-regression-budget",
+        type=float,
+        default=None,
+        help=(
+            "Fail the build if an executed notebook cell takes more than"
+            " this many times as long as in the last recorded run, e.g."
+            " 2.0. By default, cell times are only reported."
+        ),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=".build_cache",
+        help=(
+            "Folder for the build manifest, notebook execution cache and"
+            " logs. Restore this folder between CI runs to avoid"
+            " re-executing unchanged notebooks."
+        ),
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild all pages and notebooks, even if unchanged."
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help=(
+            "Hash every notebook and input file in full, instead of"
+            " reusing the hashes of files whose size, modification time"
+            " and inode are unchanged since the last build."
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=(
+            "Run the build under cProfile and print the functions with"
+            " the highest cumulative time."
+        ),
+    )
+    parser.add_argument(
+        "--asset-mode",
+        choices=["inline", "shared"],
+        default="inline",
+        help=(
+            "Include the navbar and scripts in every page ('inline'), or"
+            " load them from shared .js files cached by the browser"
+            " ('shared'). With 'shared', changes to the page index only"
+            " change the navbar script, which --dist publishes under a"
+            " fixed name."
+        ),
+    )
+    parser.add_argument(
+        "--search",
+        action="store_true",
+        help=(
+            "Add a search box to the topbar and build the full-text search"
+            " index it queries."
+        ),
+    )
+    parser.add_argument(
+        "--dist",
+        default=None,
+        help=(
+            "Folder to publish the site to, with fingerprinted static"
+            " assets and precompressed .gz/.br files."
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "After building, keep rebuilding the pages affected by changes"
+            " to content/, templates/, index.json and the bibliography."
+        ),
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help=(
+            "Serve the site locally and reload open pages after each"
+            " rebuild. Implies --watch."
+        ),
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port of the local server used with --serve.",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0.2,
+        help="Seconds between checks for changes in watch mode.",
+    )
     args = parser.parse_args()
 
+    if args.profile:
+        profile_path = os.path.join(
+            os.path.abspath(args.cache_dir),
+            "build.prof",
+        )
+        profiler = cProfile.Profile()
+        profiler.runcall(build, args)
+        os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+        profiler.dump_stats(profile_path)
+        print(f"\nSaved profile to {os.path.relpath(profile_path)}")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    else:
+        build(args)
+
+
+def get_resource_budget(args):
+    """Get the cores and memory available to notebook execution, from
+    the command line arguments or the machine"""
+    budget = get_machine_resources()
+    if args.cores is not None:
+        budget["cores"] = args.cores
+    if args.memory_gb is not None:
+        budget["memory_gb"] = args.memory_gb
+    return budget
+
+
+def build_site(
+        args,
+        manifest,
+        bibliography,
+        convert_notebooks=True,
+        ):
+    """
+    Convert the notebooks and pages whose inputs changed since the last
+    build
+
+    Arguments
+    ---------
+    args : argparse.Namespace
+        The parsed command line arguments of main
+    manifest : BuildManifest
+        Record of the inputs of the outputs generated by previous builds
+    bibliography : Bibliography
+        The parsed textbook bibliography
+    convert_notebooks : bool
+        If False, only the pages are rebuilt
+
+    Returns
+    -------
+    content_model : ContentModel
+        The scanned content folder
+    """
     content_path = os.path.join(os.getcwd(), "content")
     hash_path = os.path.join(os.getcwd(), "scripts", "notebook_hashes.json")
+    cache_path = os.path.abspath(args.cache_dir)
 
-    convert_notebooks_to_html(
-        input_folder=content_path,
-        hash_path=hash_path,
-        write_html=True,
-        execute_notebooks=args.execute_notebooks,
+    # scan the content folder once for pages, sections and notebooks
+    with timed('content scan'):
+        content_model = ContentModel(content_path)
+
+    if convert_notebooks:
+        convert_notebooks_to_html(
+            input_folder=content_path,
+            hash_path=hash_path,
+            write_html=True,
+            execute_notebooks=args.execute_notebooks,
+            manifest=manifest,
+            jobs=args.jobs,
+            log_folder=os.path.join(cache_path, "logs"),
+            cache_folder=cache_path,
+            notebook_paths=content_model.notebook_paths,
+            image_folder=os.path.join(content_path, *NOTEBOOK_IMAGES_FOLDER),
+            warm_kernels=not args.fresh_kernels,
+            resource_budget=get_resource_budget(args),
+            cell_regression_budget=args.cell_regression_budget,
+            stat_cache=manifest.stat_cache,
+        )
+
+    generate_page_html(
+        content_model.get_page_paths(),
+        manifest=manifest,
+        jobs=args.jobs,
+        bibliography=bibliography,
+        content_model=content_model,
+        asset_mode=args.asset_mode,
+        search_folder=(
+            os.path.join(cache_path, "search") if args.search else None
+        ),
+    )
+    return content_model
+
+
+def watch_site(
+        args,
+        manifest,
+        bibliography,
+        content_model,
+        ):
+    """
+    Rebuild the site whenever its sources change, until interrupted.
+    The pandoc servers, the build manifest and the parsed bibliography are
+    kept in memory between rebuilds, and the manifest limits each rebuild
+    to the pages affected by the change. With --serve, the site is also
+    served locally and open pages are reloaded after each rebuild.
+    """
+    bib_path = os.path.join(os.getcwd(), "textbook-bibliography.bib")
+    cache_path = os.path.abspath(args.cache_dir)
+
+    server = None
+    if args.serve:
+        server = DevServer(os.getcwd(), port=args.port)
+        server.start()
+        start_page = content_model.pages[0].link if content_model.pages \
+            else SITE_URL_PREFIX
+        print(f"\nServing the site at {server.get_url(start_page)}")
+
+    print("Watching for changes; press Ctrl+C to stop")
+    snapshot = get_watched_files(os.getcwd())
+    try:
+        while True:
+            time.sleep(args.poll_interval)
+            new_snapshot = get_watched_files(os.getcwd())
+            changed_files = get_changed_files(snapshot, new_snapshot)
+            if not changed_files:
+                continue
+
+            print()
+            for path in changed_files:
+                print(f"Changed: {os.path.relpath(path)}")
+
+            start_time = time.monotonic()
+            try:
+                if bib_path in changed_files:
+                    bibliography = Bibliography(
+                        bib_path,
+                        cache_folder=cache_path,
+                    )
+                manifest.clear_file_hashes()
+                with collect_timings(), count_outputs() as outputs:
+                    build_site(
+                        args,
+                        manifest,
+                        bibliography,
+                        convert_notebooks=any(
+                            path.endswith('.ipynb') for path in changed_files
+                        ),
+                    )
+                manifest.save()
+                outputs.print_summary()
+                print(f"Rebuilt in {time.monotonic() - start_time:.2f}s")
+            except Exception:
+                # keep watching so that the error can be fixed
+                traceback.print_exc()
+
+            # outputs written by the rebuild are not changes to react to
+            snapshot = get_watched_files(os.getcwd())
+            if server is not None:
+                server.notify_reload()
+    except KeyboardInterrupt:
+        print("\nStopped watching")
+    finally:
+        if server is not None:
+            server.close()
+
+
+def build(args):
+    """
+    Build the website with the parsed command line arguments of main
+    """
+    # pandoc is started by the first markdown conversion, if any
+    start_pandoc_pool(args.pandoc_workers, lazy=True)
+
+    cache_path = os.path.abspath(args.cache_dir)
+
+    # the build manifest records the inputs of every generated file so
+    # that unchanged pages and notebooks are not rebuilt; the hashes of
+    # files are cached by their stat data, unless --verify is given
+    stat_cache = StatCache(
+        os.path.join(cache_path, "stat_cache.json"),
+        verify=args.verify,
+    )
+    scripts_path = os.path.join(os.getcwd(), "scripts")
+    manifest = BuildManifest(
+        os.path.join(cache_path, "build_manifest.json"),
+        code_paths=[os.path.abspath(__file__)] + [
+            os.path.join(scripts_path, file)
+            for file in os.listdir(scripts_path)
+            if file.endswith(".py")
+        ],
+        force=args.force,
+        stat_cache=stat_cache,
     )
 
-    page_paths = get_page_paths()
-    generate_page_html(page_paths)
+    try:
+        with timed('bibliography'):
+            bibliography = Bibliography(
+                os.path.join(os.getcwd(), "textbook-bibliography.bib"),
+                cache_folder=cache_path,
+            )
+        content_model = build_site(args, manifest, bibliography)
+        manifest.save()
+
+        if args.dist:
+            with timed('static assets'):
+                build_static_site(
+                    os.getcwd(),
+                    args.dist,
+                    excluded_paths=[cache_path],
+                    published_paths=[
+                        os.path.join(os.getcwd(), *path)
+                        for path in PUBLISHED_PATHS
+                    ],
+                    # the shared navbar changes with the page index; it
+                    # keeps its name so that the pages loading it do not
+                    # change too
+                    unfingerprinted_paths=[os.path.join(
+                        os.getcwd(),
+                        *SHARED_ASSETS_FOLDER,
+                        NAVBAR_ASSET_NAME,
+                    )],
+                )
+
+        # report where the build spent its time
+        build_timer = get_build_timer()
+        build_timer.save_report(
+            os.path.join(cache_path, "build_timing.json")
+        )
+        build_timer.print_summary()
+        get_output_counter().print_summary()
+
+        if args.watch or args.serve:
+            watch_site(args, manifest, bibliography, content_model)
+    finally:
+        stop_pandoc_pool()
+        shutdown_kernel_pool()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+// ----------------------------------------
+// Full-text search
+// ----------------------------------------
+// Queries the sharded index written by scripts/search_index.py. The
+// index is stored next to this script, in search/: meta.json lists the
+// shards, docs.json describes the pages, and each shard maps the terms
+// starting with a two-character prefix to their [page, count] postings.
+// Only the shards of the terms in a query are downloaded.
+(function() {
+    const baseUrl = document.currentScript.src.replace(/[^/]*$/, "") + "search/";
+
+    // must match STOP_WORDS in scripts/search_index.py
+    const stopWords = new Set((
+        "a an and are as at be by can for from has have in is it its of on or " +
+        "that the this to was were which will with"
+    ).split(" "));
+    const maxResults = 10;
+
+    let meta = null;
+    let docs = null;
+    const shards = {};
+
+    function fetchJson(url, options) {
+        return fetch(url, options).then(function(response) {
+            if (!response.ok) {
+                throw new Error("Failed to load " + url);
+            }
+            return response.json();
+        });
+    }
+
+    // meta.json is revalidated on every page load; the other files are
+    // requested with the index version so that cached copies are reused
+    // until the index changes
+    function loadIndex() {
+        if (meta === null) {
+            meta = fetchJson(baseUrl + "meta.json", {cache: "no-cache"})
+                .then(function(data) {
+                    docs = fetchJson(baseUrl + "docs.json?v=" + data.version);
+                    return data;
+                });
+        }
+        return meta;
+    }
+
+    function getShardName(term, prefixLength) {
+        const prefix = Array.from(term).slice(0, prefixLength).join("");
+        if (/^[a-z0-9]+$/.test(prefix)) {
+            return prefix;
+        }
+        return "x" + Array.from(new TextEncoder().encode(prefix))
+            .map(function(byte) { return byte.toString(16).padStart(2, "0"); })
+            .join("");
+    }
+
+    function loadShard(name, version) {
+        if (!(name in shards)) {
+            shards[name] = fetchJson(baseUrl + name + ".json?v=" + version)
+                .catch(function() { return {}; });
+        }
+        return shards[name];
+    }
+
+    function tokenize(text) {
+        return (text.toLowerCase().match(/[\p{L}\p{N}_]+/gu) || [])
+            .filter(function(token) {
+                return token.length > 1 && !stopWords.has(token);
+            });
+    }
+
+    // score pages by tf-idf; the last term of the query also matches
+    // longer terms so that results update while typing
+    function search(query) {
+        const terms = tokenize(query);
+        if (terms.length === 0) {
+            return Promise.resolve([]);
+        }
+        return loadIndex().then(function(data) {
+            return Promise.all([
+                docs,
+                Promise.all(terms.map(function(term) {
+                    return loadShard(getShardName(term, data.prefix_length), data.version);
+                })),
+            ]).then(function(loaded) {
+                const pages = loaded[0];
+                const scores = new Map();
+                const matchedTerms = new Map();
+                terms.forEach(function(term, i) {
+                    const shard = loaded[1][i];
+                    const isLast = i === terms.length - 1;
+                    const postings = [];
+                    Object.keys(shard).forEach(function(indexTerm) {
+                        if (indexTerm === term || (isLast && indexTerm.startsWith(term))) {
+                            postings.push.apply(postings, shard[indexTerm]);
+                        }
+                    });
+                    const idf = Math.log(1 + pages.length / (1 + postings.length));
+                    postings.forEach(function(posting) {
+                        const page = posting[0];
+                        const length = pages[page][3] || 1;
+                        scores.set(page, (scores.get(page) || 0) + idf * posting[1] / length);
+                        matchedTerms.set(page, (matchedTerms.get(page) || new Set()).add(i));
+                    });
+                });
+                // rank pages that match every term first
+                return Array.from(scores.keys())
+                    .sort(function(a, b) {
+                        return (matchedTerms.get(b).size - matchedTerms.get(a).size) ||
+                            (scores.get(b) - scores.get(a));
+                    })
+                    .slice(0, maxResults)
+                    .map(function(page) {
+                        return {
+                            url: pages[page][0],
+                            title: pages[page][1],
+                            summary: pages[page][2],
+                        };
+                    });
+            });
+        });
+    }
+
+    function showResults(container, results) {
+        container.textContent = "";
+        if (results.length === 0) {
+            const message = document.createElement("div");
+            message.className = "search-no-results";
+            message.textContent = "No results";
+            container.appendChild(message);
+        }
+        results.forEach(function(result) {
+            const link = document.createElement("a");
+            link.className = "search-result";
+            link.href = result.url;
+            const title = document.createElement("div");
+            title.className = "search-result-title";
+            title.textContent = result.title;
+            const summary = document.createElement("div");
+            summary.className = "search-result-summary";
+            summary.textContent = result.summary;
+            link.appendChild(title);
+            link.appendChild(summary);
+            container.appendChild(link);
+        });
+        container.classList.add("visible");
+    }
+
+    const input = document.getElementById("search-input");
+    const container = document.getElementById("search-results");
+    if (!input || !container) {
+        return;
+    }
+
+    let latestQuery = "";
+    input.addEventListener("focus", loadIndex);
+    input.addEventListener("input", function() {
+        const query = input.value;
+        latestQuery = query;
+        if (tokenize(query).length === 0) {
+            container.classList.remove("visible");
+            return;
+        }
+        search(query).then(function(results) {
+            // ignore results of queries that were typed over
+            if (query === latestQuery) {
+                showResults(container, results);
+            }
+        }).catch(function(error) {
+            console.error(error);
+        });
+    });
+    input.addEventListener("keydown", function(event) {
+        if (event.key === "Escape") {
+            container.classList.remove("visible");
+            input.blur();
+        } else if (event.key === "Enter") {
+            const first = container.querySelector(".search-result");
+            if (first) {
+                window.location.href = first.href;
+            }
+        }
+    });
+    document.addEventListener("click", function(event) {
+        if (!event.target.closest(".search-container")) {
+            container.classList.remove("visible");
+        }
+    });
+})();
@@ -0,0 +1,664 @@
+# %% ######################################################################
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import struct
+import zlib
+import base64
+import argparse
+import tempfile
+import subprocess
+import statistics
+import nbformat
+from scripts.bibliography import parse_bibtex
+
+# %% ######################################################################
+
+# root of the repository whose build code is benchmarked
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# files and folders copied from the repository into the synthetic tree
+BUILD_FILES = [
+    "build.py",
+    "textbook-bibliography.bib",
+    "templates",
+    "scripts",
+    os.path.join("content", "assets"),
+]
+
+# name of the folder in which the synthetic textbook is generated
+SITE_FOLDER = "website_redesign"
+
+WORDS = (
+    "neocortical dipole current layer pyramidal cell dendrite soma"
+    " synaptic drive evoked response rhythm beta gamma alpha network"
+    " simulation parameter inhibitory excitatory model morphology"
+    " signal source localization feedforward feedback input spike"
+).split()
+
+
+def _make_sentence(rng, n_words):
+    words = [rng.choice(WORDS) for _ in range(n_words)]
+    return " ".join(words).capitalize() + "."
+
+
+def _make_paragraph(rng, n_sentences=5):
+    return " ".join(
+        _make_sentence(rng, rng.randint(6, 16))
+        for _ in range(n_sentences)
+    )
+
+
+def _make_png(rng, width=240, height=160):
+    """Generate a random RGB .png image without external dependencies"""
+    def chunk(tag, data):
+        return (
+            struct.pack(">I", len(data))
+            + tag
+            + data
+            + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+        )
+
+    # random noise in a few rows keeps the images distinct and roughly
+    # the size of a matplotlib figure
+    rows = []
+    for row in range(height):
+        if row % 8 == 0:
+            pixels = rng.randbytes(width * 3)
+        else:
+            pixels = bytes(rng.choice(range(256)) for _ in range(3)) * width
+        rows.append(b"\x00" + pixels)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(b"".join(rows)))
+        + chunk(b"IEND", b"")
+    )
+
+
+def _format_citation(key):
+    # keys with characters outside the pandoc key syntax need braces
+    if all(char.isalnum() or char in "_-:" for char in key):
+        return f"[@{key}]"
+    return f"[@{{{key}}}]"
+
+
+def generate_page_markdown(
+        rng,
+        title,
+        citation_keys=(),
+        n_citations=0,
+        n_paragraphs=6,
+        ):
+    """
+    Generate a markdown page with the layout of the textbook pages: a
+    title comment followed by headings, paragraphs, lists, code, math and
+    citations.
+    """
+    lines = [
+        "<!--",
+        f"# Title: {title}",
+        "# Updated: 2025-01-01",
+        "#",
+        "# Contributors:",
+        "    # Synthetic Benchmark",
+        "-->",
+        "",
+        f"# {title}",
+        "",
+    ]
+
+    citations = [
+        _format_citation(rng.choice(citation_keys))
+        for _ in range(n_citations)
+    ] if citation_keys else []
+
+    for index in range(n_paragraphs):
+        if index % 3 == 0:
+            lines += [f"## {_make_sentence(rng, 3)[:-1]}", ""]
+        paragraph = _make_paragraph(rng)
+        if citations:
+            paragraph += f" {_make_sentence(rng, 5)[:-1]} {citations.pop()}."
+        lines += [paragraph, ""]
+        if index % 3 == 1:
+            lines += [
+                f"- {_make_sentence(rng, 6)}" for _ in range(4)
+            ] + [""]
+        if index % 3 == 2:
+            lines += [
+                "```python",
+                "from hnn_core import jones_2009_model, simulate_dipole",
+                "net = jones_2009_model()",
+                "dpls = simulate_dipole(net, tstop=170.)",
+                "```",
+                "",
+                "The dipole is $Q = \\sum_i I_i \\cdot d_i$.",
+                "",
+            ]
+
+    # cite any remaining references in a closing paragraph
+    if citations:
+        lines += [f"{_make_paragraph(rng, 2)} {' '.join(citations)}", ""]
+
+    return "\n".join(lines)
+
+
+def generate_notebook(
+        rng,
+        title,
+        n_cells=20,
+        n_images=3,
+        ):
+    """
+    Generate an executed notebook with alternating markdown and code
+    cells, stream outputs and .png figures.
+    """
+    notebook = nbformat.v4.new_notebook()
+    notebook.metadata["kernelspec"] = {
+        "display_name": "Python 3",
+        "language": "python",
+        "name": "python3",
+    }
+    notebook.cells.append(nbformat.v4.new_markdown_cell(f"# {title}"))
+
+    n_code_cells = max(n_cells // 2, 1)
+    image_cells = set(rng.sample(
+        range(n_code_cells),
+        min(n_images, n_code_cells),
+    ))
+
+    for index in range(n_code_cells):
+        notebook.cells.append(nbformat.v4.new_markdown_cell(
+            f"## Step {index + 1}\n\n{_make_paragraph(rng, 3)}"
+            " Values are compared with `<` and `>`."
+        ))
+
+        outputs = [nbformat.v4.new_output(
+            "stream",
+            name="stdout",
+            text="\n".join(
+                f"Trial {trial}: {rng.random():.6f}" for trial in range(5)
+            ) + "\n",
+        )]
+        if index in image_cells:
+            outputs.append(nbformat.v4.new_output(
+                "display_data",
+                data={
+                    "image/png": base64.b64encode(
+                        _make_png(rng)
+                    ).decode("ascii"),
+                    "text/plain": "<Figure size 640x480 with 1 Axes>",
+                },
+            ))
+        notebook.cells.append(nbformat.v4.new_code_cell(
+            source=(
+                f"values_{index} = simulate(trial={index})\n"
+                f"print_values(values_{index})"
+            ),
+            execution_count=index + 1,
+            outputs=outputs,
+        ))
+
+    return notebook
+
+
+def generate_textbook(
+        site_path,
+        sections=8,
+        pages_per_section=6,
+        depth=2,
+        notebooks=4,
+        cells_per_notebook=20,
+        images_per_notebook=3,
+        citations_per_page=3,
+        seed=0,
+        ):
+    """
+    Generate a synthetic textbook with the build code of this repository.
+
+    Arguments
+    ---------
+    site_path : str
+        Folder to create
+    sections : int
+        Number of sections (folders with a README.md)
+    pages_per_section : int
+        Number of markdown pages in each section
+    depth : int
+        1 to place all pages directly in content/, or 2 to place them in
+        section folders. The navbar supports a single level of sections.
+    notebooks : int
+        Number of executed notebooks, distributed over the sections and
+        each embedded in one page
+    cells_per_notebook : int
+        Number of cells in each notebook
+    images_per_notebook : int
+        Number of .png outputs in each notebook
+    citations_per_page : int
+        Number of bibliography citations in each page
+    seed : int
+        Seed of the random content
+
+    Returns
+    -------
+    page_paths : list of str
+        Paths to the generated markdown pages
+    notebook_paths : list of str
+        Paths to the generated notebooks
+    """
+    if depth not in (1, 2):
+        raise ValueError("depth must be 1 or 2")
+
+    rng = random.Random(seed)
+
+    # copy the build code
+    # ------------------------------------------------------------
+    if os.path.exists(site_path):
+        shutil.rmtree(site_path)
+    for item in BUILD_FILES:
+        source = os.path.join(REPO_ROOT, item)
+        destination = os.path.join(site_path, item)
+        if os.path.isdir(source):
+            shutil.copytree(
+                source,
+                destination,
+                ignore=shutil.ignore_patterns("__pycache__"),
+            )
+        else:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copy2(source, destination)
+
+    # start without any recorded notebook hashes
+    with open(
+        os.path.join(site_path, "scripts", "notebook_hashes.json"), "w",
+    ) as f:
+        json.dump({}, f)
+
+    with open(os.path.join(site_path, "textbook-bibliography.bib")) as f:
+        citation_keys = sorted(parse_bibtex(f.read())[0])
+
+    # generate the pages and notebooks
+    # ------------------------------------------------------------
+    content_path = os.path.join(site_path, "content")
+    width = len(str(max(sections, pages_per_section, 1)))
+
+    section_paths = []
+    for section in range(sections):
+        if depth == 1:
+            section_paths.append(content_path)
+            continue
+        section_path = os.path.join(
+            content_path,
+            f"{section + 1:0{width}d}_section_{section + 1}",
+        )
+        os.makedirs(section_path, exist_ok=True)
+        with open(os.path.join(section_path, "README.md"), "w") as f:
+            f.write(
+                "<!--\n"
+                f"# Title: {section + 1}. {_make_sentence(rng, 3)[:-1]}\n"
+                "-->\n"
+            )
+        section_paths.append(section_path)
+
+    page_paths = []
+    section_pages = []
+    for section, section_path in enumerate(section_paths):
+        section_pages.append([])
+        for page in range(pages_per_section):
+            # file names must be unique across sections, since the
+            # navbar and notebook hashes are keyed by file name
+            number = section * pages_per_section + page + 1
+            md_name = (
+                f"{number:0{width * 2}d}_s{section + 1}_page_{page + 1}.md"
+            )
+            page_path = os.path.join(section_path, md_name)
+            markdown_text = generate_page_markdown(
+                rng,
+                title=f"{section + 1}.{page + 1} {_make_sentence(rng, 4)}",
+                citation_keys=citation_keys,
+                n_citations=citations_per_page,
+            )
+            with open(page_path, "w", encoding="utf-8") as f:
+                f.write(markdown_text)
+            page_paths.append(page_path)
+            section_pages[-1].append(page_path)
+
+    notebook_paths = []
+    for index in range(notebooks):
+        section = index % max(sections, 1)
+        nb_name = f"notebook_s{section + 1}_{index + 1}.ipynb"
+        nb_path = os.path.join(section_paths[section], nb_name)
+        notebook = generate_notebook(
+            rng,
+            title=f"Notebook {index + 1}",
+            n_cells=cells_per_notebook,
+            n_images=images_per_notebook,
+        )
+        with open(nb_path, "w", encoding="utf-8") as f:
+            nbformat.write(notebook, f)
+        notebook_paths.append(nb_path)
+
+        # embed the notebook in a page of the same section
+        pages = section_pages[section]
+        if pages:
+            page_path = pages[(index // max(sections, 1)) % len(pages)]
+            with open(page_path, "a", encoding="utf-8") as f:
+                f.write(f"\n[[{nb_name}]]\n")
+
+    return page_paths, notebook_paths
+
+
+# %% ######################################################################
+
+
+def run_build(
+        site_path,
+        build_args=(),
+        log_path=None,
+        ):
+    """
+    Run build.py in the synthetic textbook.
+
+    Returns
+    -------
+    duration : float
+        Wall time of the build, in seconds
+    stages : dict
+        Time spent in each build stage, from the build timing report
+    """
+    cache_path = os.path.join(site_path, ".build_cache")
+    command = [
+        sys.executable,
+        "build.py",
+        "--cache-dir",
+        cache_path,
+        *build_args,
+    ]
+
+    start_time = time.monotonic()
+    result = subprocess.run(
+        command,
+        cwd=site_path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    duration = time.monotonic() - start_time
+
+    if log_path:
+        with open(log_path, "a") as f:
+            f.write(f"$ {' '.join(command)}\n{result.stdout}\n")
+    if result.returncode != 0:
+        print(result.stdout[-3000:])
+        raise RuntimeError(
+            f"Build failed with exit code {result.returncode}"
+        )
+
+    stages = {}
+    report_path = os.path.join(cache_path, "build_timing.json")
+    if os.path.exists(report_path):
+        with open(report_path) as f:
+            stages = json.load(f)["stages"]
+    return duration, stages
+
+
+def _edit_page(page_path):
+    with open(page_path, "a", encoding="utf-8") as f:
+        f.write(f"\nEdited for the benchmark at {time.time()}.\n")
+
+
+def _edit_notebook(nb_path):
+    with open(nb_path, "r", encoding="utf-8") as f:
+        notebook = nbformat.read(f, as_version=4)
+    notebook.cells[0].source += f"\n\nEdited at {time.time()}."
+    with open(nb_path, "w", encoding="utf-8") as f:
+        nbformat.write(notebook, f)
+
+
+def run_benchmark(
+        work_folder,
+        textbook_options,
+        build_args=(),
+        repeat=3,
+        ):
+    """
+    Measure the full build, no-op rebuild, single page edit and single
+    notebook edit of a synthetic textbook.
+
+    Arguments
+    ---------
+    work_folder : str
+        Folder in which the synthetic textbook is generated
+    textbook_options : dict
+        Keyword arguments of generate_textbook
+    build_args : list of str
+        Extra command line arguments for build.py
+    repeat : int
+        Number of times each scenario is measured; the fastest run is
+        reported to reduce noise
+
+    Returns
+    -------
+    results : dict
+        For each scenario, the fastest and median durations and the
+        stage times of the fastest run
+    """
+    site_path = os.path.join(work_folder, SITE_FOLDER)
+    log_path = os.path.join(work_folder, "benchmark_build.log")
+    runs = {
+        "full_build": [],
+        "noop_rebuild": [],
+        "page_edit": [],
+        "notebook_edit": [],
+    }
+
+    for iteration in range(repeat):
+        print(f"Run {iteration + 1}/{repeat}")
+        page_paths, notebook_paths = generate_textbook(
+            site_path,
+            **textbook_options,
+        )
+
+        runs["full_build"].append(run_build(site_path, build_args, log_path))
+        runs["noop_rebuild"].append(
+            run_build(site_path, build_args, log_path)
+        )
+
+        _edit_page(page_paths[len(page_paths) // 2])
+        runs["page_edit"].append(run_build(site_path, build_args, log_path))
+
+        if notebook_paths:
+            _edit_notebook(notebook_paths[len(notebook_paths) // 2])
+            runs["notebook_edit"].append(
+                run_build(site_path, build_args, log_path)
+            )
+
+    results = {}
+    for scenario, measurements in runs.items():
+        if not measurements:
+            continue
+        durations = [duration for duration, _ in measurements]
+        fastest = durations.index(min(durations))
+        results[scenario] = {
+            "min": durations[fastest],
+            "median": statistics.median(durations),
+            "stages": measurements[fastest][1],
+        }
+    return results
+
+
+def compare_to_baseline(
+        results,
+        baseline,
+        tolerance=0.2,
+        ):
+    """
+    Compare benchmark results with a previous run.
+
+    Returns
+    -------
+    regressions : list of str
+        Scenarios whose fastest run is slower than the baseline by more
+        than the tolerance (a fraction of the baseline time)
+    """
+    regressions = []
+    for scenario, result in results.items():
+        if scenario not in baseline["results"]:
+            continue
+        baseline_time = baseline["results"][scenario]["min"]
+        change = (result["min"] - baseline_time) / max(baseline_time, 1e-9)
+        print(
+            f"  {scenario:<16}{baseline_time:8.2f}s ->"
+            f" {result['min']:8.2f}s ({change:+.0%})"
+        )
+        if change > tolerance:
+            regressions.append(scenario)
+    return regressions
+
+
+def main():
+    """
+    Benchmark build.py on a synthetic textbook
+    """
+    parser = argparse.ArgumentParser(
+        description=(
+            "Measure full, no-op and incremental build times of a"
+            " synthetic textbook."
+        )
+    )
+    parser.add_argument("--sections", type=int, default=8)
+    parser.add_argument("--pages-per-section", type=int, default=6)
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=2,
+        choices=[1, 2],
+        help="1 for pages in content/, 2 for pages in section folders.",
+    )
+    parser.add_argument("--notebooks", type=int, default=4)
+    parser.add_argument("--cells-per-notebook", type=int, default=20)
+    parser.add_argument("--images-per-notebook", type=int, default=3)
+    parser.add_argument("--citations-per-page", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times each scenario is measured.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Passed to build.py.",
+    )
+    parser.add_argument(
+        "--pandoc-workers",
+        type=int,
+        default=2,
+        help="Passed to build.py.",
+    )
+    parser.add_argument(
+        "--work-dir",
+        default=None,
+        help=(
+            "Folder for the synthetic textbook; a temporary folder is"
+            " used and removed by default."
+        ),
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Path of the .json file to write the results to.",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help=(
+            "Results .json of a previous run; exit with an error if any"
+            " scenario is slower by more than --tolerance."
+        ),
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown relative to the baseline (default 0.2).",
+    )
+    args = parser.parse_args()
+
+    textbook_options = {
+        "sections": args.sections,
+        "pages_per_section": args.pages_per_section,
+        "depth": args.depth,
+        "notebooks": args.notebooks,
+        "cells_per_notebook": args.cells_per_notebook,
+        "images_per_notebook": args.images_per_notebook,
+        "citations_per_page": args.citations_per_page,
+        "seed": args.seed,
+    }
+    build_args = [
+        "--jobs",
+        str(args.jobs),
+        "--pandoc-workers",
+        str(args.pandoc_workers),
+    ]
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        results = run_benchmark(
+            os.path.abspath(args.work_dir),
+            textbook_options,
+            build_args,
+            repeat=args.repeat,
+        )
+    else:
+        with tempfile.TemporaryDirectory() as work_folder:
+            results = run_benchmark(
+                work_folder,
+                textbook_options,
+                build_args,
+                repeat=args.repeat,
+            )
+
+    print(f"\nBuild times (fastest of {args.repeat}):")
+    for scenario, result in results.items():
+        print(
+            f"  {scenario:<16}{result['min']:8.2f}s"
+            f" (median {result['median']:.2f}s)"
+        )
+
+    report = {
+        "textbook": textbook_options,
+        "build_args": build_args,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nComparison with {args.baseline}:")
+        regressions = compare_to_baseline(
+            results,
+            baseline,
+            tolerance=args.tolerance,
+        )
+        if regressions:
+            print(
+                "Build time regressions in: " + ", ".join(regressions)
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# %% ######################################################################
+import os
+import re
+import json
+import hashlib
+from scripts.output_files import write_atomic
+
+# %% ######################################################################
+
+# characters allowed inside a pandoc citation key, e.g. [@jones_neural_2007]
+CITATION_KEY_PATTERN = re.compile(
+    r"@\{([^}]+)\}|@([\w:.#$%&\-+?<>~/]+)"
+)
+# punctuation that may follow a citation key without being part of it
+CITATION_KEY_TRAILING = ":.#$%&-+?<>~/"
+
+
+def parse_bibtex(bib_text):
+    """
+    Split a BibTeX file into its entries.
+
+    Returns
+    -------
+    entries : dict
+        Mapping of citation keys to the raw text of each entry
+    shared : list of str
+        @string and @preamble blocks, which every entry may depend on
+    """
+    entries = {}
+    shared = []
+
+    for match in re.finditer(r"^@(\w+)\s*\{", bib_text, flags=re.MULTILINE):
+        # find the closing brace of the entry
+        depth = 0
+        for end in range(match.end() - 1, len(bib_text)):
+            if bib_text[end] == "{":
+                depth += 1
+            elif bib_text[end] == "}":
+                depth -= 1
+                if depth == 0:
+                    break
+        block = bib_text[match.start():end + 1]
+
+        entry_type = match.group(1).lower()
+        if entry_type in ("string", "preamble"):
+            shared.append(block)
+        elif entry_type != "comment":
+            key = block[match.end() - match.start():].split(",", 1)[0]
+            entries[key.strip()] = block
+
+    return entries, shared
+
+
+class Bibliography:
+    """
+    BibTeX bibliography parsed once per build, used to give citeproc only
+    the entries that a page actually cites.
+
+    The parsed entries are cached by the hash of the .bib file, and the
+    per-page subsets are written as content-addressed .bib files so that
+    they can be shared between pages and worker processes.
+
+    Arguments
+    ---------
+    bib_path : str
+        Path to the BibTeX file
+    cache_folder : str
+        Folder for the parsed bibliography and the per-page subsets
+    """
+
+    def __init__(
+            self,
+            bib_path,
+            cache_folder,
+            ):
+        self.bib_path = bib_path
+        self.cache_folder = os.path.join(cache_folder, "bibliography")
+
+        with open(bib_path, "rb") as f:
+            bib_bytes = f.read()
+        self.bib_hash = hashlib.sha256(bib_bytes).hexdigest()
+
+        parsed_path = os.path.join(self.cache_folder, f"{self.bib_hash}.json")
+        parsed = None
+        try:
+            with open(parsed_path, "r", encoding="utf-8") as f:
+                parsed = json.load(f)
+        except (OSError, ValueError):
+            # not parsed yet, or left unreadable by an older build
+            pass
+        if parsed is None:
+            entries, shared = parse_bibtex(bib_bytes.decode("utf-8"))
+            parsed = {"entries": entries, "shared": shared}
+            write_atomic(parsed_path, json.dumps(parsed))
+
+        self.entries = parsed["entries"]
+        self.shared = parsed["shared"]
+
+    def get_cited_keys(self, markdown_text):
+        """Get the sorted keys of the bibliography entries cited in a
+        markdown page"""
+        cited_keys = set()
+        for match in CITATION_KEY_PATTERN.finditer(markdown_text):
+            key = match.group(1) or match.group(2)
+            # e.g. "@jones_neural_2007." at the end of a sentence
+            while key and key not in self.entries and \
+                    key[-1] in CITATION_KEY_TRAILING:
+                key = key[:-1]
+            if key in self.entries:
+                cited_keys.add(key)
+        return sorted(cited_keys)
+
+    def get_page_bibliography(self, markdown_text):
+        """
+        Get the bibliography file to use when converting a markdown page.
+
+        Returns
+        -------
+        bib_path : str | None
+            Path to a .bib file with only the cited entries, the full
+            bibliography if the page uses `nocite`, or None if the page
+            cites nothing and citeproc can be skipped
+        """
+        if "nocite" in markdown_text:
+            return self.bib_path
+
+        cited_keys = self.get_cited_keys(markdown_text)
+        if not cited_keys:
+            return None
+
+        subset_text = "\n\n".join(
+            self.shared + [self.entries[key] for key in cited_keys]
+        ) + "\n"
+        subset_hash = hashlib.sha256(subset_text.encode("utf-8")).hexdigest()
+        subset_path = os.path.join(
+            self.cache_folder,
+            "subsets",
+            f"{subset_hash}.bib",
+        )
+        if not os.path.exists(subset_path):
+            os.makedirs(os.path.dirname(subset_path), exist_ok=True)
+            temp_path = f"{subset_path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(subset_text)
+            os.replace(temp_path, subset_path)
+        return subset_path
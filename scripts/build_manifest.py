@@ -0,0 +1,160 @@
+# %% ######################################################################
+import os
+import json
+import hashlib
+from scripts.output_files import write_atomic
+
+# %% ######################################################################
+
+
+def hash_text(text):
+    """Generate a SHA256 hash of a string"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BuildManifest:
+    """
+    Record of the inputs used to generate each output file, used to skip
+    rebuilding outputs whose inputs have not changed since the last build.
+
+    Each entry maps an output path (relative to the root directory) to
+    the hashes of its inputs and a fingerprint of the build code, so that
+    changes to build.py or scripts/ also trigger a rebuild.
+
+    Arguments
+    ---------
+    manifest_path : str
+        Path to the .json file used to persist the manifest
+    code_paths : list of str
+        Source files whose contents affect the generated outputs
+    force : bool
+        If True, treat every output as out of date
+    stat_cache : StatCache | None
+        Persistent cache of file hashes, so that files whose stat data is
+        unchanged since a previous build are not read and hashed again
+    """
+
+    def __init__(
+            self,
+            manifest_path,
+            code_paths=(),
+            force=False,
+            stat_cache=None,
+            ):
+        self.manifest_path = manifest_path
+        self.force = force
+        self.stat_cache = stat_cache
+        self.entries = {}
+        self.seen = set()
+        self._file_hashes = {}
+
+        try:
+            with open(manifest_path, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            # no previous build, or a manifest left unreadable by an
+            # older build; everything is rebuilt
+            self.entries = {}
+
+        self.code_hash = hash_text(
+            "".join(self.hash_file(path) for path in sorted(code_paths))
+        )
+
+    def _key(self, output_path):
+        return os.path.relpath(output_path, os.getcwd())
+
+    def hash_file(
+            self,
+            file_path,
+            content=None,
+            ):
+        """Generate a SHA256 hash of a file, reusing the hash if the file
+        was already hashed during this build, or if its stat data is
+        unchanged since it was hashed by a previous build. The contents of
+        the file can be given if they were already read."""
+        if file_path not in self._file_hashes:
+            file_hash = None
+            if content is None and self.stat_cache is not None:
+                file_hash = self.stat_cache.get(file_path, "sha256")
+
+            if file_hash is None:
+                hasher = hashlib.sha256()
+                if content is None:
+                    with open(file_path, "rb") as f:
+                        content = f.read()
+                hasher.update(content)
+                file_hash = hasher.hexdigest()
+                if self.stat_cache is not None:
+                    self.stat_cache.set(file_path, "sha256", file_hash)
+            self._file_hashes[file_path] = file_hash
+        return self._file_hashes[file_path]
+
+    def clear_file_hashes(self):
+        """Forget the file hashes of the previous build, e.g. before
+        rebuilding in watch mode"""
+        self._file_hashes = {}
+
+    def is_up_to_date(
+            self,
+            output_path,
+            input_hashes,
+            extra_outputs=(),
+            ):
+        """
+        Check whether an output was generated from the given inputs by
+        the current build code and still exists on disk.
+
+        Arguments
+        ---------
+        output_path : str
+            Path of the generated file used as the manifest key
+        input_hashes : dict
+            Mapping of input names to hashes
+        extra_outputs : list of str
+            Additional files generated alongside output_path that must
+            also exist
+
+        Returns
+        -------
+        up_to_date : bool
+        """
+        key = self._key(output_path)
+        self.seen.add(key)
+
+        if self.force:
+            return False
+
+        for path in [output_path, *extra_outputs]:
+            if not os.path.exists(path):
+                return False
+
+        entry = self.entries.get(key)
+        return entry == {
+            "code": self.code_hash,
+            "inputs": input_hashes,
+        }
+
+    def record(
+            self,
+            output_path,
+            input_hashes,
+            ):
+        """Record the inputs used to generate an output"""
+        key = self._key(output_path)
+        self.seen.add(key)
+        self.entries[key] = {
+            "code": self.code_hash,
+            "inputs": input_hashes,
+        }
+
+    def save(self):
+        """Save the manifest, dropping outputs not seen in this build, and
+        the stat cache"""
+        entries = {
+            key: entry
+            for key, entry in sorted(self.entries.items())
+            if key in self.seen
+        }
+        write_atomic(self.manifest_path, json.dumps(entries, indent=4))
+        if self.stat_cache is not None:
+            self.stat_cache.save()
@@ -0,0 +1,134 @@
+# %% ######################################################################
+import os
+import json
+import time
+import contextlib
+from collections import defaultdict
+from scripts.output_files import write_atomic
+
+# %% ######################################################################
+
+
+class BuildTimer:
+    """
+    Wall-time recorder for the stages of a build.
+
+    Stages may be nested; the time recorded for a stage excludes the time
+    spent in the stages nested inside it, so that the stage times add up
+    to the total time spent in instrumented code. Times can optionally be
+    attributed to an item, e.g. a page or a notebook.
+    """
+
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.stages = defaultdict(float)
+        self.items = defaultdict(lambda: defaultdict(float))
+        # [time spent in nested stages, item] for each active stage
+        self._active_stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name, item=None):
+        """Time a block of code as part of a stage. Nested stages are
+        attributed to the item of the enclosing stage by default."""
+        if item is None and self._active_stages:
+            item = self._active_stages[-1][1]
+        self._active_stages.append([0.0, item])
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start_time
+            child_time, _ = self._active_stages.pop()
+            if self._active_stages:
+                self._active_stages[-1][0] += duration
+            self.record(name, duration - child_time, item=item)
+
+    def record(self, name, duration, item=None):
+        """Add a measured duration to a stage"""
+        self.stages[name] += duration
+        if item is not None:
+            self.items[item][name] += duration
+
+    def merge(self, stages, item=None):
+        """Add the stage times recorded by another timer, e.g. in a
+        worker process"""
+        for name, duration in stages.items():
+            self.record(name, duration, item=item)
+
+    def report(self):
+        """Get the recorded times as a json-serializable dict"""
+        def sort_times(times):
+            return dict(
+                sorted(times.items(), key=lambda item: -item[1])
+            )
+
+        def item_report(extension):
+            items = {
+                item: {
+                    "total": sum(stages.values()),
+                    "stages": sort_times(stages),
+                }
+                for item, stages in self.items.items()
+                if item.endswith(extension)
+            }
+            return dict(
+                sorted(items.items(), key=lambda item: -item[1]["total"])
+            )
+
+        return {
+            "total": time.monotonic() - self.start_time,
+            "stages": sort_times(self.stages),
+            "pages": item_report(".html"),
+            "notebooks": item_report(".ipynb"),
+        }
+
+    def save_report(self, report_path):
+        """Write the timing report as json"""
+        write_atomic(report_path, json.dumps(self.report(), indent=4))
+
+    def print_summary(self, n_items=5):
+        """Print the time spent in each stage and the slowest items"""
+        report = self.report()
+
+        print(f"\nBuild finished in {report['total']:.2f}s")
+        for name, duration in report["stages"].items():
+            percent = 100 * duration / max(report["total"], 1e-9)
+            print(f"  {name:<28}{duration:8.2f}s {percent:5.1f}%")
+
+        for category in ("pages", "notebooks"):
+            items = list(report[category].items())[:n_items]
+            if items:
+                print(f"Slowest {category}:")
+                for item, times in items:
+                    print(f"  {item:<60}{times['total']:8.2f}s")
+
+
+# timer used by the current process
+_build_timer = BuildTimer()
+
+
+def get_build_timer():
+    """Get the timer used by the current process"""
+    return _build_timer
+
+
+def timed(name, item=None):
+    """Time a block of code as part of a build stage"""
+    return _build_timer.stage(name, item=item)
+
+
+@contextlib.contextmanager
+def collect_timings():
+    """
+    Record the stage times of a block of code on a separate timer, e.g.
+    in a worker process, so that they can be returned to and merged by
+    the main process.
+    """
+    global _build_timer
+
+    parent_timer = _build_timer
+    _build_timer = BuildTimer()
+    try:
+        yield _build_timer
+    finally:
+        _build_timer = parent_timer
@@ -0,0 +1,182 @@
+# %% ######################################################################
+import time
+import hashlib
+
+# %% ######################################################################
+
+# cell metadata key of the execution time and peak memory of a cell
+PROFILE_METADATA_KEY = "execution_profile"
+
+# cells that got slower by less than this are not reported as
+# regressions, since the times of short cells vary a lot between runs
+MIN_REGRESSION_SECONDS = 1.0
+
+
+def _reset_peak_rss(pid):
+    """Reset the peak RSS of a process, on Linux"""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _read_peak_rss(pid):
+    """Read the peak RSS of a process in MB, on Linux, or None"""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class CellProfiler:
+    """
+    Record the wall time and peak memory of each code cell executed by an
+    ExecutePreprocessor, in the metadata of the cell.
+
+    The peak memory is the peak resident set size of the kernel process
+    while the cell runs. It is read from /proc, so it is only recorded on
+    Linux, and it does not include processes started by the cell, e.g.
+    MPI workers.
+
+    Arguments
+    ---------
+    client : ExecutePreprocessor
+        The preprocessor whose cell execution hooks are used
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._start_time = None
+        client.on_cell_execute = self.on_cell_execute
+        client.on_cell_executed = self.on_cell_executed
+
+    def _get_kernel_pid(self):
+        try:
+            return self.client.km.provisioner.process.pid
+        except AttributeError:
+            return None
+
+    def on_cell_execute(self, cell, cell_index):
+        pid = self._get_kernel_pid()
+        if pid is not None:
+            _reset_peak_rss(pid)
+        self._start_time = time.monotonic()
+
+    def on_cell_executed(self, cell, cell_index, execute_reply):
+        duration = time.monotonic() - self._start_time
+        pid = self._get_kernel_pid()
+        cell.metadata[PROFILE_METADATA_KEY] = {
+            "duration": round(duration, 3),
+            "peak_rss_mb": _read_peak_rss(pid) if pid is not None else None,
+        }
+
+
+def get_cell_timings(notebook):
+    """
+    Get the recorded times and peak memory of the code cells of an
+    executed notebook, as saved to its .json output.
+
+    Returns
+    -------
+    cell_timings : list of dict
+        For each profiled cell, its 'index' in the notebook, its
+        'duration' in seconds, its 'peak_rss_mb', the hash of its source
+        and its first line
+    """
+    cell_timings = []
+    for index, cell in enumerate(notebook.cells):
+        profile = cell.get("metadata", {}).get(PROFILE_METADATA_KEY)
+        if cell.cell_type != "code" or not profile:
+            continue
+        lines = [line for line in cell.source.splitlines() if line.strip()]
+        cell_timings.append({
+            "index": index,
+            "duration": profile["duration"],
+            "peak_rss_mb": profile.get("peak_rss_mb"),
+            "source_hash": hashlib.sha256(
+                cell.source.encode("utf-8")
+            ).hexdigest()[:12],
+            "first_line": lines[0][:80] if lines else "",
+        })
+    return cell_timings
+
+
+def find_regressions(
+        cell_timings,
+        previous_timings,
+        budget,
+        ):
+    """
+    Find the cells that got slower than the budget allows since the last
+    recorded run. Cells are compared to the cell at the same position,
+    if its code is unchanged.
+
+    Arguments
+    ---------
+    cell_timings : list of dict
+        Cell timings of the current run, from get_cell_timings
+    previous_timings : list of dict
+        Cell timings of the last recorded run
+    budget : float
+        Maximum ratio of the current to the previous time of a cell
+
+    Returns
+    -------
+    regressions : list of (dict, dict)
+        The current and previous timings of each slower cell
+    """
+    previous_by_index = {
+        timing["index"]: timing for timing in previous_timings
+    }
+    regressions = []
+    for timing in cell_timings:
+        previous = previous_by_index.get(timing["index"])
+        if previous is None or \
+                previous.get("source_hash") != timing["source_hash"]:
+            continue
+        if timing["duration"] > budget * previous["duration"] and \
+                timing["duration"] - previous["duration"] > \
+                MIN_REGRESSION_SECONDS:
+            regressions.append((timing, previous))
+    return regressions
+
+
+def print_slowest_cells(
+        notebook_timings,
+        n_cells=10,
+        ):
+    """
+    Print the slowest cells across notebooks.
+
+    Arguments
+    ---------
+    notebook_timings : dict
+        Mapping of notebook names to their cell timings
+    n_cells : int
+        Number of cells to print
+    """
+    cells = sorted(
+        (
+            (timing, nb_name)
+            for nb_name, cell_timings in notebook_timings.items()
+            for timing in cell_timings
+        ),
+        key=lambda item: -item[0]["duration"],
+    )[:n_cells]
+    if not cells:
+        return
+
+    print("\nSlowest notebook cells:")
+    for timing, nb_name in cells:
+        memory = timing["peak_rss_mb"]
+        memory = f"{memory:8.0f} MB" if memory is not None else " " * 11
+        cell_name = f"{nb_name} cell {timing['index']}"
+        print(
+            f"  {timing['duration']:8.2f}s{memory}  {cell_name:<50}"
+            f" {timing['first_line']}"
+        )
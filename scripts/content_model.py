@@ -0,0 +1,154 @@
+# %% ######################################################################
+import os
+
+# %% ######################################################################
+
+# prefix of the page links, i.e. the path of the site on the web server
+SITE_URL_PREFIX = '/website_redesign/'
+
+
+def get_title(file_path):
+    """Get the title from the `# Title: ` header of a markdown file, or
+    'NA' if there is none"""
+    title = 'NA'
+    with open(file_path, 'r') as file:
+        for line in file:
+            if "# Title: " in line:
+                title = line[9:]
+                if title.endswith('\n'):
+                    title = title[0:-1]
+    return title
+
+
+class ContentPage:
+    """
+    A markdown page of the textbook.
+
+    Arguments
+    ---------
+    md_path : str
+        Path to the markdown file
+    site_path : str
+        Root folder of the site, used to build the page link
+    """
+
+    def __init__(
+            self,
+            md_path,
+            site_path,
+            ):
+        self.md_path = md_path
+        self.md_name = os.path.basename(md_path)
+        self.title = get_title(md_path)
+
+        # remove leading `##_` from page and change extension to .html
+        html_name = self.md_name.split("_", 1)[1]
+        html_name = html_name.split(".md")[0] + ".html"
+        self.out_path = os.path.join(os.path.dirname(md_path), html_name)
+
+        relative_path = os.path.relpath(self.out_path, site_path)
+        self.link = SITE_URL_PREFIX + relative_path.replace(os.sep, '/')
+
+
+class ContentSection:
+    """
+    A folder of the content tree. Folders with a README.md are sections
+    of the textbook and are listed in the page index and navbar.
+
+    Arguments
+    ---------
+    path : str
+        Path to the folder
+    """
+
+    def __init__(
+            self,
+            path,
+            ):
+        self.path = path
+        self.name = os.path.basename(path)
+        # title from the README.md, or None if the folder has no README
+        self.title = None
+        # pages and subfolders, sorted by name
+        self.entries = []
+
+
+class ContentModel:
+    """
+    The pages, sections and notebooks of the content folder, collected
+    with a single os.scandir pass and shared by the page index, the navbar
+    and page discovery.
+
+    Arguments
+    ---------
+    content_path : str | None
+        Path to the content folder; defaults to content/ in the current
+        working directory
+    """
+
+    def __init__(
+            self,
+            content_path=None,
+            ):
+        if content_path is None:
+            content_path = os.path.join(os.getcwd(), "content")
+        self.content_path = content_path
+        self.site_path = os.path.dirname(os.path.abspath(content_path))
+        self.pages = []
+        self.notebook_paths = []
+        self.root = self._scan(content_path)
+
+    def _scan(self, path):
+        section = ContentSection(path)
+
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+
+        pages = []
+        subfolders = []
+        for entry in entries:
+            if entry.is_dir():
+                subfolders.append(entry.path)
+            elif entry.name == "README.md":
+                section.title = get_title(entry.path)
+            elif entry.name.endswith(".md"):
+                pages.append(ContentPage(entry.path, self.site_path))
+            elif entry.name.endswith(".ipynb"):
+                self.notebook_paths.append(entry.path)
+        self.pages += pages
+
+        # folders are scanned after the files of their parent, so that
+        # notebooks are listed in the same order as with os.walk
+        subsections = [self._scan(subfolder) for subfolder in subfolders]
+
+        section.entries = sorted(
+            [(page.md_name, page) for page in pages]
+            + [(subsection.name, subsection) for subsection in subsections],
+            key=lambda entry: entry[0],
+        )
+        return section
+
+    def get_page_index(self, section=None):
+        """
+        Get the page index written to index.json: a mapping of page file
+        names to titles, and of section folder names to their title and
+        index. Only folders with a README.md are included.
+        """
+        if section is None:
+            section = self.root
+
+        page_index = {}
+        for name, entry in section.entries:
+            if isinstance(entry, ContentPage):
+                page_index[name] = entry.title
+            elif entry.title is not None:
+                page_index[name] = [entry.title, self.get_page_index(entry)]
+        return page_index
+
+    def get_page_links(self):
+        """Get the site links of all pages, keyed by markdown file name"""
+        return {page.md_name: page.link for page in self.pages}
+
+    def get_page_paths(self):
+        """Get the paths of all markdown pages, keyed by file name"""
+        return {page.md_name: page.md_path for page in self.pages}
@@ -0,0 +1,405 @@
+# %% ######################################################################
+import os
+import re
+import json
+import atexit
+import base64
+import socket
+import itertools
+import subprocess
+import threading
+import time
+import uuid
+import urllib.request
+import urllib.error
+from scripts.build_timing import timed
+
+# %% ######################################################################
+
+# the "-auto_identifiers" extension disables the automatic ids added to
+# header tags
+PANDOC_FROM_FORMAT = "markdown-auto_identifiers"
+
+# active pool of pandoc server workers; when None, every conversion
+# spawns its own pandoc process through pypandoc
+_pandoc_pool = None
+# number of pandoc server workers to start with the first conversion, as
+# requested by start_pandoc_pool(lazy=True)
+_pending_pool_size = 0
+
+
+class PandocServerPool:
+    """
+    Pool of long-lived `pandoc server` processes that convert markdown to
+    html over HTTP, avoiding one pandoc process launch per conversion.
+
+    Arguments
+    ---------
+    size : int
+        Number of pandoc server processes to start
+    startup_timeout : float
+        Seconds to wait for each server to accept requests
+    request_timeout : int
+        Seconds pandoc is allowed to spend on a single conversion
+    """
+
+    def __init__(
+            self,
+            size=2,
+            startup_timeout=10,
+            request_timeout=120,
+            ):
+        self.size = size
+        self.startup_timeout = startup_timeout
+        self.request_timeout = request_timeout
+        self.processes = []
+        self.urls = []
+        # pid of the process that started the servers; worker processes
+        # forked from it share the servers but must not stop them
+        self.owner_pid = None
+        self._url_cycle = None
+        self._lock = threading.Lock()
+        self._file_cache = {}
+
+    def start(self):
+        """Start the pandoc servers. Returns False if pandoc server is
+        unavailable (e.g., pandoc < 3.0)."""
+        import pypandoc
+
+        try:
+            pandoc_path = pypandoc.get_pandoc_path()
+        except OSError:
+            return False
+
+        self.owner_pid = os.getpid()
+        for _ in range(self.size):
+            port = _get_free_port()
+            try:
+                process = subprocess.Popen(
+                    [
+                        pandoc_path,
+                        "server",
+                        f"--port={port}",
+                        f"--timeout={self.request_timeout}",
+                    ],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            except OSError:
+                break
+            self.processes.append(process)
+            url = f"http://127.0.0.1:{port}"
+            if self._wait_until_ready(process, url):
+                self.urls.append(url)
+
+        if not self.urls:
+            self.close()
+            return False
+
+        self._url_cycle = itertools.cycle(self.urls)
+        return True
+
+    def _wait_until_ready(self, process, url):
+        """Poll the /version endpoint until the server responds"""
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            # the process exits immediately if `pandoc server` is not
+            # supported by the installed pandoc
+            if process.poll() is not None:
+                return False
+            try:
+                with urllib.request.urlopen(f"{url}/version", timeout=1):
+                    return True
+            except urllib.error.URLError as e:
+                # keep polling until the server starts listening
+                if not isinstance(e.reason, ConnectionRefusedError):
+                    return False
+                time.sleep(0.05)
+            except OSError:
+                # the server accepted the connection but failed to
+                # respond (e.g., pandoc built without the threaded
+                # runtime)
+                return False
+        return False
+
+    def _encode_file(self, file_path):
+        """Base64-encode a resource file (e.g., the bibliography) once"""
+        mtime = os.path.getmtime(file_path)
+        cached = self._file_cache.get(file_path)
+        if cached is None or cached[0] != mtime:
+            with open(file_path, "rb") as f:
+                encoded = base64.b64encode(f.read()).decode("ascii")
+            cached = (mtime, encoded)
+            self._file_cache[file_path] = cached
+        return cached[1]
+
+    def convert(
+            self,
+            markdown_text,
+            bibliography=None,
+            ):
+        """Convert markdown to html on the next server in the pool"""
+        request = {
+            "text": markdown_text,
+            "from": PANDOC_FROM_FORMAT,
+            "to": "html",
+            "html-math-method": "mathml",
+            # pandoc server disables highlighting unless a style is set,
+            # while the command line defaults to "pygments"
+            "highlight-style": "pygments",
+        }
+        if bibliography:
+            request["citeproc"] = True
+            request["files"] = {
+                bibliography: self._encode_file(bibliography),
+            }
+            request["metadata"] = {
+                "bibliography": {"t": "MetaString", "c": bibliography},
+            }
+
+        with self._lock:
+            url = next(self._url_cycle)
+
+        http_request = urllib.request.Request(
+            url,
+            data=json.dumps(request).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(
+            http_request,
+            timeout=self.request_timeout,
+        ) as response:
+            html_content = response.read().decode("utf-8")
+
+        # match the trailing newline written by the pandoc command line
+        return html_content + "\n"
+
+    def close(self):
+        """Stop all pandoc servers, or, in a forked worker process, only
+        stop using them"""
+        if os.getpid() != self.owner_pid:
+            self.processes = []
+            self.urls = []
+            return
+
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = []
+        self.urls = []
+
+
+def _get_free_port():
+    """Ask the OS for an unused local port"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_pandoc_pool(
+        size=2,
+        lazy=False,
+        ):
+    """
+    Start a pool of pandoc server workers used by all subsequent calls to
+    convert_markdown_to_html. Falls back to per-call conversion if the
+    servers cannot be started.
+
+    If lazy is True, the servers are only started by the first
+    conversion, or by ensure_pandoc_pool, so that builds with no markdown
+    to convert do not wait for pandoc to start.
+    """
+    global _pandoc_pool, _pending_pool_size
+
+    stop_pandoc_pool()
+    if size < 1:
+        return False
+    if lazy:
+        _pending_pool_size = size
+        return True
+
+    pool = PandocServerPool(size=size)
+    if pool.start():
+        _pandoc_pool = pool
+        atexit.register(stop_pandoc_pool)
+        print(f"Started {len(pool.urls)} pandoc server worker(s)")
+        return True
+
+    print(
+        "pandoc server is unavailable; falling back to one pandoc"
+        " process per conversion"
+    )
+    return False
+
+
+def ensure_pandoc_pool():
+    """Start the pool requested by start_pandoc_pool(lazy=True), if it is
+    not started yet. This must be called before starting worker processes
+    that convert markdown, so that they share the pool of the main
+    process instead of each starting their own."""
+    global _pending_pool_size
+
+    if _pending_pool_size:
+        size = _pending_pool_size
+        _pending_pool_size = 0
+        with timed('pandoc startup'):
+            start_pandoc_pool(size)
+
+
+def stop_pandoc_pool():
+    """Stop the active pandoc server pool, if any. In a worker process
+    forked from the process that started the pool, the pool is only
+    dropped, and its servers keep serving the other processes."""
+    global _pandoc_pool, _pending_pool_size
+
+    _pending_pool_size = 0
+    if _pandoc_pool is not None:
+        _pandoc_pool.close()
+        _pandoc_pool = None
+
+
+def convert_markdown_to_html(
+        markdown_text,
+        bibliography=None,
+        ):
+    """
+    Convert markdown text to html with pandoc, using the pandoc server
+    pool when it is running.
+
+    Arguments
+    ---------
+    markdown_text : str
+        Markdown to convert
+    bibliography : str | None
+        Path to a bibliography file. When provided, citations are
+        processed with citeproc.
+
+    Returns
+    -------
+    html_content : str
+    """
+    import pypandoc
+
+    ensure_pandoc_pool()
+    if _pandoc_pool is not None:
+        try:
+            return _pandoc_pool.convert(
+                markdown_text,
+                bibliography=bibliography,
+            )
+        except urllib.error.HTTPError:
+            # pandoc rejected this document; use the command line below
+            # so that the error is reported as usual
+            pass
+        except (urllib.error.URLError, OSError) as e:
+            print(
+                f"pandoc server failed ({e}); falling back to one pandoc"
+                " process per conversion"
+            )
+            stop_pandoc_pool()
+
+    extra_args = []
+    if bibliography:
+        extra_args += [
+            f"--bibliography={bibliography}",
+            "--citeproc",
+        ]
+    extra_args += [
+        "--mathml",
+        "-f",
+        PANDOC_FROM_FORMAT,
+    ]
+
+    html_content = pypandoc.convert_text(
+        markdown_text,
+        format='md',
+        to='html',
+        extra_args=extra_args,
+    )
+    return html_content
+
+
+def _has_document_level_markdown(markdown_text):
+    """
+    Check for markdown constructs that are resolved across the whole
+    document (reference links, footnotes, numbered example lists) and
+    would therefore render differently when cells share one document.
+    """
+    return bool(
+        re.search(r"^ {0,3}\[[^\]]+\]:", markdown_text, flags=re.MULTILINE)
+        or "[^" in markdown_text
+        or "(@" in markdown_text
+    )
+
+
+def convert_markdown_batch_to_html(markdown_texts):
+    """
+    Convert several independent markdown documents with a single pandoc
+    invocation. The documents are joined with unique html comment
+    sentinels and the converted html is split back apart at the
+    sentinels. Documents that cannot safely share a pandoc run, because
+    they use markdown resolved across the whole document, are converted
+    on their own.
+
+    Arguments
+    ---------
+    markdown_texts : list of str
+        Markdown documents to convert
+
+    Returns
+    -------
+    html_contents : list of str
+        The converted html for each document, identical to calling
+        convert_markdown_to_html on each document separately
+    """
+    markdown_texts = list(markdown_texts)
+    batched_indices = [
+        index for index, text in enumerate(markdown_texts)
+        if not _has_document_level_markdown(text)
+    ]
+    html_contents = [None] * len(markdown_texts)
+    if len(batched_indices) >= 2:
+        batched_html = _convert_markdown_batch(
+            [markdown_texts[index] for index in batched_indices]
+        )
+        if batched_html is not None:
+            for index, html_content in zip(batched_indices, batched_html):
+                html_contents[index] = html_content
+
+    return [
+        convert_markdown_to_html(text) if html_content is None
+        else html_content
+        for text, html_content in zip(markdown_texts, html_contents)
+    ]
+
+
+def _convert_markdown_batch(markdown_texts):
+    """Convert documents joined with sentinels in one pandoc run, or
+    return None if the output cannot be split back apart"""
+    token = f"cell-separator-{uuid.uuid4().hex}"
+    batched_markdown = "\n\n".join(
+        f"<!-- {token} -->\n\n{text}"
+        for text in markdown_texts
+    )
+    batched_html = convert_markdown_to_html(batched_markdown)
+
+    html_contents = re.split(
+        rf"^<!-- {token} -->\n",
+        batched_html,
+        flags=re.MULTILINE,
+    )[1:]
+    if len(html_contents) != len(markdown_texts):
+        # a cell swallowed a sentinel (e.g., an unclosed code fence)
+        return None
+
+    # pandoc always ends its output with a newline, including for empty
+    # documents
+    return [
+        html_content if html_content else "\n"
+        for html_content in html_contents
+    ]
@@ -1,24 +1,50 @@
 # %%
 import os
+import sys
+import time
 import base64
 import html
 import re
 import json
-import nbformat
+import contextlib
+import traceback
+import concurrent.futures
 # import markdown
+import copy
 import hashlib
-import pypandoc
-from nbconvert.preprocessors import (
-    ExecutePreprocessor,
-    ClearOutputPreprocessor,
+from scripts.build_timing import get_build_timer, timed
+from scripts.cell_profiler import (
+    CellProfiler,
+    find_regressions,
+    get_cell_timings,
+    print_slowest_cells,
 )
+from scripts.convert_markdown import (
+    convert_markdown_to_html,
+    convert_markdown_batch_to_html,
+)
+from scripts.execution_cache import (
+    CellExecutionCache,
+    NotebookExecutionCache,
+)
+from scripts.image_store import ImageStore
+from scripts.kernel_pool import get_kernel_pool
+from scripts.notebook_scheduler import (
+    DEFAULT_RESOURCES,
+    NotebookDurations,
+    ResourceScheduler,
+    get_machine_resources,
+    get_notebook_resources,
+    load_resource_config,
+)
+from scripts.output_files import write_if_changed
+from scripts.stat_cache import StatCache
 
 
 def save_plot_as_image(img_data, img_filename, output_dir):
     """Saves the plot image to the specified directory."""
     img_path = os.path.join(output_dir, img_filename)
-    with open(img_path, "wb") as img_file:
-        img_file.write(base64.b64decode(img_data))
+    write_if_changed(img_path, base64.b64decode(img_data))
     return
 
 
@@ -159,16 +185,40 @@ def extract_html_from_notebook(
         notebook,
         input_dir,
         filename,
-        use_base64=False
+        use_base64=False,
+        batch_markdown=True,
+        image_store=None,
         ):
     """Extracts HTML for cell contents and outputs,
-    including code and markdown."""
+    including code and markdown.
+
+    When batch_markdown is True, all markdown cells are converted with a
+    single pandoc invocation instead of one invocation per cell.
+
+    Figures are saved to the ImageStore if one is provided, and otherwise
+    to an output_nb_<name> folder next to the notebook."""
 
     html_output = []
     fig_id = 0
     delim = os.path.sep
     aggregated_output = ""
 
+    # escape < and > characters in markdown cells
+    markdown_cells = [
+        html.escape(cell["source"])
+        for cell in notebook["cells"]
+        if cell["cell_type"] == "markdown"
+    ]
+    with timed("pandoc conversion"):
+        if batch_markdown:
+            markdown_html = convert_markdown_batch_to_html(markdown_cells)
+        else:
+            markdown_html = [
+                convert_markdown_to_html(markdown_content)
+                for markdown_content in markdown_cells
+            ]
+    markdown_html = iter(markdown_html)
+
     for cell in notebook["cells"]:
         if cell["cell_type"] == "code":
             # add code cell contents
@@ -228,6 +278,18 @@ def extract_html_from_notebook(
                             f"{img_data}'/>"
                             "\n</div>"
                         )
+                    elif image_store is not None:
+                        # save the image once in the shared image store
+                        img_path = image_store.add(
+                            img_data,
+                            os.path.join(input_dir, filename),
+                        )
+                        img_src = os.path.relpath(img_path, input_dir)
+                        html_output.append(
+                            "<div class='output-cell'>"
+                            f"\n\t<img src='{img_src.replace(delim, '/')}'/>"
+                            "\n</div>"
+                        )
                     else:
                         # save the image as a file and reference it in HTML
                         fig_id += 1
@@ -283,29 +345,7 @@ def extract_html_from_notebook(
                 aggregated_output = ""
 
         elif cell["cell_type"] == "markdown":
-            # escape < and > characters
-            markdown_content = html.escape(cell["source"])
-
-            # html_content = markdown.markdown(markdown_content)
-
-            html_content = pypandoc.convert_text(
-                markdown_content,
-                format='md',
-                to='html',
-                extra_args=[
-                    "--mathml",
-                    # the "-f", "markdown-auto_identifiers" arguments below
-                    # disable the automatic ids added to header tags
-                    "-f",
-                    "markdown-auto_identifiers",
-                ],
-            )
-
-            # print(
-            #     "Markdown:", type(html_content), html_content[0:50],
-            #     '\n',
-            #     "Pandoc:", type(test), test[0:50]
-            # )
+            html_content = next(markdown_html)
 
             html_output.append(
                 "<div class='markdown-cell'>"
@@ -318,28 +358,97 @@ def extract_html_from_notebook(
     return html_output
 
 
-def hash_notebook(notebook_path):
-    """Generate a SHA256 hash of the notebook, ignoring outputs/metadata."""
+def remove_figure_folder(
+        input_dir,
+        filename,
+        ):
+    """Remove the figures that extract_html_from_notebook saved to the
+    output_nb_<name> folder of a notebook without an image store"""
+    output_dir = os.path.join(
+        input_dir,
+        "output_nb_" + filename.split('.ipynb')[0],
+    )
+    if not os.path.isdir(output_dir):
+        return
+    for file_name in os.listdir(output_dir):
+        if re.fullmatch(r"fig_\d+\.png", file_name):
+            os.remove(os.path.join(output_dir, file_name))
+    if not os.listdir(output_dir):
+        os.rmdir(output_dir)
 
-    with open(notebook_path, "r", encoding="utf-8") as f:
-        nb = nbformat.read(f, as_version=4)
 
-    # clear all cell outputs
-    preprocessor = ClearOutputPreprocessor()
-    preprocessor.preprocess(nb, {})
+def read_notebook(notebook_path):
+    """
+    Read a notebook file once, for both hashing and conversion.
+
+    Returns
+    -------
+    notebook : nbformat.NotebookNode
+        The parsed notebook
+    notebook_bytes : bytes
+        The contents of the file
+    """
+    import nbformat
 
-    # remove execution counts and cell metadata
-    for cell in nb.cells:
-        if "execution_count" in cell:
-            cell["execution_count"] = None
-        if "metadata" in cell:
-            cell["metadata"] = {}
+    with open(notebook_path, "rb") as f:
+        notebook_bytes = f.read()
+    notebook = nbformat.reads(notebook_bytes.decode("utf-8"), as_version=4)
+    return notebook, notebook_bytes
 
-    # remove notebook metadata
-    nb.metadata = {}
 
-    # serialize cleaned notebook
-    notebook_json = nbformat.writes(nb, version=4).encode("utf-8")
+def hash_notebook(
+        notebook_path,
+        notebook=None,
+        ):
+    """Generate a SHA256 hash of the notebook, ignoring outputs/metadata.
+
+    The hash is computed from a cleaned copy of the notebook without its
+    outputs, execution counts and metadata, serialized like
+    nbformat.writes, so the hashes match previously saved hashes. The
+    copy is shallow, so the outputs of a parsed notebook are not copied
+    or serialized. notebook can be given to avoid reading the file
+    again."""
+    import nbformat
+    from nbformat.v4.nbjson import BytesEncoder
+    from nbformat.v4.rwbase import split_lines
+
+    if notebook is None:
+        notebook, _ = read_notebook(notebook_path)
+
+    cells = []
+    for cell in notebook.cells:
+        cleaned_cell = nbformat.NotebookNode({
+            key: value
+            for key, value in cell.items()
+            if key not in ("outputs", "attachments")
+        })
+        if "attachments" in cell:
+            # attachments are split into lines in place when serialized
+            cleaned_cell["attachments"] = copy.deepcopy(cell["attachments"])
+        if cell.cell_type == "code":
+            cleaned_cell["outputs"] = []
+            cleaned_cell["execution_count"] = None
+        elif "execution_count" in cell:
+            cleaned_cell["execution_count"] = None
+        if "metadata" in cell:
+            cleaned_cell["metadata"] = {}
+        cells.append(cleaned_cell)
+
+    cleaned_notebook = nbformat.NotebookNode({
+        **notebook,
+        "cells": cells,
+        "metadata": {},
+    })
+
+    # serialize cleaned notebook with the settings of nbformat.writes
+    notebook_json = json.dumps(
+        split_lines(cleaned_notebook),
+        cls=BytesEncoder,
+        indent=1,
+        sort_keys=True,
+        separators=(",", ": "),
+        ensure_ascii=False,
+    ).encode("utf-8")
 
     # generate hash
     hasher = hashlib.sha256()
@@ -363,27 +472,65 @@ def save_notebook_hashes(
     """Save updated notebook hashes"""
 
     # print(f'Saving hashes to {hash_path}')
-    with open(hash_path, "w") as f:
-        json.dump(new_hashes, f, indent=4)
+    write_if_changed(hash_path, json.dumps(new_hashes, indent=4))
 
 
 def get_notebook(
         notebook_path,
         execute,
         timeout=600,
+        cell_cache=None,
+        notebook=None,
+        kernel_pool=None,
         ):
-    """Get a jupyter notebook object and optionally execute it"""
-    with open(notebook_path, "r", encoding="utf-8") as f:
-        notebook = nbformat.read(f, as_version=4)
+    """Get a jupyter notebook object and optionally execute it
+
+    If a CellExecutionCache is provided, the outputs of a notebook whose
+    code cells are all unchanged are restored from the cache instead of
+    executing the notebook, and the outputs of executed notebooks are
+    saved to the cache. An already parsed notebook can be given, which is
+    then executed in place instead of reading the file again.
+
+    If a KernelPool is provided, the notebook is executed in a warm
+    kernel from the pool instead of a new kernel.
+
+    The wall time and peak memory of each executed code cell are recorded
+    in the cell metadata by a CellProfiler."""
+    from nbconvert.preprocessors import ExecutePreprocessor
+
+    if notebook is None:
+        notebook, _ = read_notebook(notebook_path)
 
     if execute:
+        if cell_cache is not None and cell_cache.restore_notebook(notebook):
+            print(
+                f"Restored outputs of '{os.path.basename(notebook_path)}'"
+                " from the cell execution cache"
+            )
+            return notebook
+
         ep = ExecutePreprocessor(
             timeout=timeout,
             kernel_name="python3"
         )
-        ep.preprocess(
-            notebook, {"metadata": {"path": os.path.dirname(notebook_path)}}
-        )
+        CellProfiler(ep)
+        resources = {
+            "metadata": {"path": os.path.dirname(notebook_path)}
+        }
+        if kernel_pool is None:
+            ep.preprocess(notebook, resources)
+        else:
+            with kernel_pool.kernel(resources["metadata"]["path"]) as km:
+                try:
+                    ep.preprocess(notebook, resources, km=km)
+                finally:
+                    # the kernel is kept alive, but the channels opened
+                    # by the preprocessor are not reused
+                    if ep.kc is not None:
+                        ep.kc.stop_channels()
+
+        if cell_cache is not None:
+            cell_cache.save_notebook(notebook)
 
     return notebook
 
@@ -400,6 +547,10 @@ def is_notebook_fully_executed(notebook):
     return True
 
 
+# start of the .json outputs written by convert_notebooks_to_html
+FULL_EXECUTED_PATTERN = re.compile(r'\{\s*"full_executed":\s*(true|false)\b')
+
+
 def notebook_has_json_output(
         root,
         filename
@@ -413,21 +564,382 @@ def notebook_has_json_output(
 
     if os.path.exists(json_path):
         with open(json_path, 'r') as file:
+            # the execution status is written first, so the rest of the
+            # file (with the html of every section) is only parsed for
+            # files written differently
+            match = FULL_EXECUTED_PATTERN.match(file.read(64))
+            if match:
+                return match.group(1) == "true"
+            file.seek(0)
             nb_outputs = json.load(file)
             execution_check = nb_outputs.get('full_executed', False)
 
     return execution_check
 
 
+def load_cell_timings(json_path):
+    """Load the cell timings saved to the .json output of a notebook by a
+    previous build"""
+    if not os.path.exists(json_path):
+        return []
+    with open(json_path, 'r') as file:
+        return json.load(file).get('cell_timings', [])
+
+
+def find_notebooks(input_folder):
+    """Get the paths to all .ipynb files in the input folder, sorted so
+    that notebooks are always processed in the same order"""
+    notebook_paths = []
+    for root, list_folders, list_files in os.walk(input_folder):
+        list_folders.sort()
+        for filename in sorted(list_files):
+            if filename.endswith(".ipynb"):
+                notebook_paths.append(os.path.join(root, filename))
+    return notebook_paths
+
+
+def execute_notebook_job(
+        nb_path,
+        timeout=600,
+        log_path=None,
+        capture_output=False,
+        cache_folder=None,
+        notebook=None,
+        warm_kernel=False,
+        ):
+    """
+    Execute a notebook, optionally logging its progress to a file. This is
+    a top-level function so that it can be run in a worker process.
+
+    Arguments
+    ---------
+    nb_path : str
+        Path to the .ipynb notebook
+    timeout : int
+        Maximum execution time for each cell, in seconds
+    log_path : str | None
+        Path to the per-notebook log file
+    capture_output : bool
+        If True, also send everything written to the process's stdout and
+        stderr (including kernel messages) to the log file. Only use this
+        in worker processes.
+    cache_folder : str | None
+        Folder for the cell execution cache. If None, the notebook is
+        always executed.
+    notebook : nbformat.NotebookNode | None
+        The parsed notebook, to execute in place when running in the
+        same process; otherwise the notebook is read from nb_path
+    warm_kernel : bool
+        If True, execute the notebook in a warm kernel from the kernel
+        pool of the current process, which is reused by the next
+        notebooks executed by the process
+
+    Returns
+    -------
+    notebook : nbformat.NotebookNode | str
+        The executed notebook. It is serialized with nbformat when it
+        was read from nb_path, to be returned from a worker process.
+    duration : float
+        Execution time in seconds
+    """
+    import nbformat
+
+    log_file = None
+    if log_path:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        log_file = open(log_path, "w", encoding="utf-8")
+
+    def log(message):
+        if log_file:
+            log_file.write(f"{time.strftime('%H:%M:%S')} {message}\n")
+            log_file.flush()
+
+    notebook_was_given = notebook is not None
+
+    # get the pool before redirecting the output, since the kernels of
+    # the pool outlive this notebook and keep writing to the output the
+    # pool was created with
+    kernel_pool = get_kernel_pool() if warm_kernel else None
+
+    log(f"Executing {nb_path}")
+    saved_fds = None
+    if log_file and capture_output:
+        # redirect at the file descriptor level so that output from the
+        # kernel subprocess is captured as well; the original output is
+        # restored afterwards for the next notebook run by this worker
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_fds = (os.dup(1), os.dup(2))
+        os.dup2(log_file.fileno(), 1)
+        os.dup2(log_file.fileno(), 2)
+
+    start_time = time.monotonic()
+    try:
+        with contextlib.redirect_stdout(log_file or sys.stdout), \
+                contextlib.redirect_stderr(log_file or sys.stderr):
+            notebook = get_notebook(
+                nb_path,
+                execute=True,
+                timeout=timeout,
+                cell_cache=(
+                    CellExecutionCache(os.path.join(cache_folder, "cells"))
+                    if cache_folder else None
+                ),
+                notebook=notebook,
+                kernel_pool=kernel_pool,
+            )
+    except Exception:
+        log(f"Execution failed:\n{traceback.format_exc()}")
+        raise
+    finally:
+        duration = time.monotonic() - start_time
+        log(f"Finished after {duration:.1f}s")
+        if saved_fds is not None:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, saved_fd in zip((1, 2), saved_fds):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+        if log_file:
+            log_file.close()
+
+    if notebook_was_given:
+        return notebook, duration
+    return nbformat.writes(notebook), duration
+
+
+def execute_notebooks_in_parallel(
+        nb_paths,
+        jobs=1,
+        log_folder=None,
+        cache_folder=None,
+        notebooks=None,
+        warm_kernel_paths=(),
+        resources=None,
+        budget=None,
+        durations=None,
+        ):
+    """
+    Execute notebooks with up to `jobs` notebooks running at once, each
+    in its own worker process and kernel.
+
+    When notebooks run in parallel, a ResourceScheduler starts them
+    longest expected execution time first, without exceeding the cores
+    and memory of the budget with the resources used by the running
+    notebooks.
+
+    Notebooks in warm_kernel_paths are executed in a warm kernel that is
+    reused by the next notebooks of the same process, so that starting
+    a kernel and importing the common modules is paid once per process
+    instead of once per notebook. Other notebooks get a new kernel.
+
+    Arguments
+    ---------
+    nb_paths : list of str
+        Paths to the notebooks to execute
+    jobs : int
+        Maximum number of notebooks executed concurrently
+    log_folder : str | None
+        Folder for the per-notebook log files
+    cache_folder : str | None
+        Folder for the cell execution cache
+    notebooks : dict | None
+        Mapping of notebook paths to parsed notebooks. When notebooks are
+        executed serially, these are executed in place instead of
+        reading the files again.
+    warm_kernel_paths : collection of str
+        Paths to the notebooks to execute in a warm kernel
+    resources : dict | None
+        Mapping of notebook paths to the 'cores' and 'memory_gb' they
+        use; notebooks use DEFAULT_RESOURCES by default
+    budget : dict | None
+        Total 'cores' and 'memory_gb' of the notebooks running at once;
+        defaults to the cores and memory of the machine
+    durations : NotebookDurations | None
+        Execution times of previous builds, used to order notebooks,
+        which are updated with the measured times
+
+    Returns
+    -------
+    executed_notebooks : dict
+        Mapping of notebook paths to executed notebook objects, in the
+        same order as nb_paths
+    """
+    if not nb_paths:
+        return {}
+
+    import nbformat
+
+    def get_log_path(nb_path):
+        if not log_folder:
+            return None
+        nb_name = os.path.splitext(os.path.basename(nb_path))[0]
+        return os.path.join(log_folder, f"{nb_name}.log")
+
+    executed_notebooks = {}
+
+    if jobs <= 1 or len(nb_paths) <= 1:
+        for nb_path in nb_paths:
+            notebook = (notebooks or {}).get(nb_path)
+            if notebook is None:
+                notebook, _ = read_notebook(nb_path)
+            executed_notebook, duration = execute_notebook_job(
+                nb_path,
+                log_path=get_log_path(nb_path),
+                cache_folder=cache_folder,
+                notebook=notebook,
+                warm_kernel=nb_path in warm_kernel_paths,
+            )
+            print(
+                f"Executed '{os.path.basename(nb_path)}' in {duration:.1f}s"
+            )
+            if durations is not None:
+                durations.record(nb_path, duration)
+            get_build_timer().record(
+                "notebook execution",
+                duration,
+                item=os.path.relpath(nb_path),
+            )
+            executed_notebooks[nb_path] = executed_notebook
+        return executed_notebooks
+
+    if budget is None:
+        budget = get_machine_resources()
+    resources = {
+        nb_path: {
+            **DEFAULT_RESOURCES,
+            **(resources or {}).get(nb_path, {}),
+        }
+        for nb_path in nb_paths
+    }
+    scheduler = ResourceScheduler(
+        nb_paths,
+        resources,
+        budget,
+        max_running=jobs,
+        expected_durations={
+            nb_path: durations.get(nb_path)
+            for nb_path in nb_paths
+        } if durations is not None else None,
+    )
+
+    budget_text = f"{budget['cores']} cores"
+    if budget.get("memory_gb") is not None:
+        budget_text += f" and {budget['memory_gb']:.0f} GB of memory"
+    print(
+        f"\nExecuting {len(nb_paths)} notebooks with up to {jobs} running"
+        f" at once, within {budget_text}"
+    )
+    futures = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+        while scheduler.has_pending() or running:
+            for nb_path in scheduler.start_ready():
+                future = pool.submit(
+                    execute_notebook_job,
+                    nb_path,
+                    log_path=get_log_path(nb_path),
+                    capture_output=True,
+                    cache_folder=cache_folder,
+                    warm_kernel=nb_path in warm_kernel_paths,
+                )
+                futures[nb_path] = future
+                running[future] = nb_path
+
+            # report progress as notebooks finish, and release their
+            # resources for the next notebooks
+            done, _ = concurrent.futures.wait(
+                running,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                nb_path = running.pop(future)
+                scheduler.finish(nb_path)
+                nb_name = os.path.basename(nb_path)
+                if future.exception() is not None:
+                    print(f"Execution of '{nb_name}' failed")
+                else:
+                    print(
+                        f"Executed '{nb_name}' in"
+                        f" {future.result()[1]:.1f}s"
+                    )
+                    if durations is not None:
+                        durations.record(nb_path, future.result()[1])
+
+    # collect the results in a deterministic order; this re-raises the
+    # first execution error, if any
+    for nb_path in nb_paths:
+        notebook_json, duration = futures[nb_path].result()
+        get_build_timer().record(
+            "notebook execution",
+            duration,
+            item=os.path.relpath(nb_path),
+        )
+        executed_notebooks[nb_path] = nbformat.reads(
+            notebook_json,
+            as_version=4,
+        )
+
+    return executed_notebooks
+
+
 def convert_notebooks_to_html(
         input_folder=None,
         use_base64=False,
         write_html=False,
         execute_notebooks=False,
         hash_path="notebook_hashes.json",
+        manifest=None,
+        jobs=1,
+        log_folder=None,
+        cache_folder=None,
+        notebook_paths=None,
+        image_folder=None,
+        warm_kernels=False,
+        resource_budget=None,
+        cell_regression_budget=None,
+        stat_cache=None,
         ):
     """
     Executes and converts .ipynb files in the input folder to HTML.
+
+    Notebooks that need to be executed are executed first, with up to
+    `jobs` notebooks running concurrently, and all notebooks are then
+    converted in a fixed (sorted) order.
+
+    If a BuildManifest is provided, notebooks that were not executed and
+    whose .ipynb file is unchanged since the last build are not
+    converted again. If a cache folder is provided, executed notebooks
+    and code cell outputs are cached there and restored instead of
+    executing notebooks whose contents or code are unchanged.
+
+    The hashes of notebooks are recorded in a StatCache, which is created
+    in the cache folder unless one is given, so that notebooks whose
+    stat data is unchanged are not read and parsed just to hash them.
+
+    The notebooks to process can be given as notebook_paths, e.g. from a
+    ContentModel; otherwise the input folder is searched for notebooks.
+
+    If an image folder is provided, figures are saved to an ImageStore in
+    that folder, and stored figures that are no longer used by any of
+    the notebooks are removed.
+
+    If warm_kernels is True, notebooks are executed in warm kernels that
+    are reused across notebooks, except for the notebooks listed under
+    'fresh_kernel' in scripts/notebooks_to_skip.json, which need a
+    pristine interpreter and always get a new kernel.
+
+    Notebooks executed in parallel are scheduled within the resource
+    budget (a dict of total 'cores' and 'memory_gb', by default those of
+    the machine), using the resources declared for each notebook in
+    scripts/notebook_resources.json or in its metadata, and the
+    execution times recorded in the cache folder by previous builds.
+
+    The time and peak memory of the cells of executed notebooks are saved
+    to the .json outputs, and the slowest cells are reported. If a cell
+    regression budget is given, e.g. 2.0, the build fails when a cell
+    whose code is unchanged takes more than that many times as long as in
+    the last recorded run.
     """
 
     if not input_folder:
@@ -436,173 +948,379 @@ def convert_notebooks_to_html(
 
     # load saved notebook hashes
     notebook_hashes = load_notebook_hashes(hash_path)
-    # create a copy of the hashes to update and save
-    updated_hashes = notebook_hashes.copy()
+    # hashes to update and save
+    updated_hashes = {}
 
     # get list of notebooks to skip
     with open(
         os.path.join(os.getcwd(), 'scripts', 'notebooks_to_skip.json'), 'r',
     ) as f:
         notebooks_to_skip = json.load(f)
+    fresh_kernel_notebooks = notebooks_to_skip.get('fresh_kernel', [])
     notebooks_to_skip = notebooks_to_skip['skip_execution']
 
-    # iterate through input directory and process notebooks
-    for root, list_folders, list_files in os.walk(input_folder):
-        for filename in list_files:
-            if filename.endswith(".ipynb"):
-                print(
-                    f"\nProcessing notebook: {filename}"
-                )
+    # resources used by the notebooks that start their own workers
+    resource_config = load_resource_config(
+        os.path.join(os.getcwd(), 'scripts', 'notebook_resources.json')
+    )
 
-                # get current hash of the notebook
-                nb_path = os.path.join(root, filename)
-                current_hash = hash_notebook(nb_path)
+    # executed notebooks are cached by their hash so that unchanged
+    # notebooks are not executed again, e.g. when the cache folder is
+    # restored in CI
+    notebook_cache = None
+    durations = None
+    if cache_folder:
+        notebook_cache = NotebookExecutionCache(
+            os.path.join(cache_folder, "notebooks")
+        )
+        durations = NotebookDurations(
+            os.path.join(cache_folder, "notebook_durations.json")
+        )
+        if stat_cache is None:
+            stat_cache = StatCache(
+                os.path.join(cache_folder, "stat_cache.json")
+            )
 
-                # get the notebook without executing it
-                loaded_notebook = get_notebook(
-                    nb_path,
-                    execute=False,
-                )
+    # figures shared by several notebooks are stored once
+    image_store = None
+    if image_folder:
+        image_store = ImageStore(image_folder)
+
+    # ----------------------------------------
+    # determine which notebooks need to be executed
+    # ----------------------------------------
+    notebooks = []
+    if notebook_paths is None:
+        notebook_paths = find_notebooks(input_folder)
+    for nb_path in notebook_paths:
+        root, filename = os.path.split(nb_path)
+        print(
+            f"\nProcessing notebook: {filename}"
+        )
 
-                # check if the notebook has been fully executed
-                notebook_executed = notebook_has_json_output(
-                    root,
-                    filename,
-                )
+        # reuse the hash of a notebook whose size and modification time
+        # are unchanged since it was last hashed; it is then only read
+        # if it is executed or converted
+        notebook = None
+        current_hash = None
+        if stat_cache is not None:
+            current_hash = stat_cache.get(nb_path, "notebook_hash")
+
+        if current_hash is None:
+            # read the notebook once; the parsed notebook is hashed,
+            # executed and converted
+            with timed("notebook loading", item=os.path.relpath(nb_path)):
+                notebook, notebook_bytes = read_notebook(nb_path)
+
+            # get current hash of the notebook
+            with timed("notebook hashing", item=os.path.relpath(nb_path)):
+                current_hash = hash_notebook(nb_path, notebook)
+                if manifest is not None:
+                    manifest.hash_file(nb_path, content=notebook_bytes)
+            if stat_cache is not None:
+                stat_cache.set(nb_path, "notebook_hash", current_hash)
+
+        # check if the notebook has been fully executed
+        notebook_executed = notebook_has_json_output(
+            root,
+            filename,
+        )
 
-                # check if notebook should be skipped
-                skip_notebook = False
-                if filename in notebooks_to_skip:
-                    skip_notebook = True
+        # check if notebook should be skipped
+        skip_notebook = False
+        if filename in notebooks_to_skip:
+            skip_notebook = True
 
-                # for cases where the hash has not changed
-                if skip_notebook:
-                    print(
-                        f"Notebook '{filename}' has been flagged to be"
-                        " skipped. Execution will not be attempted for"
-                        " this notebook."
-                    )
-                elif (filename in notebook_hashes) and \
-                        (notebook_hashes[filename] == current_hash):
-
-                    # check if notebook has been fully executed
-                    if not notebook_executed:
-                        print(
-                            f"Warning: Notebook {filename} has not been"
-                            " fully executed."
-                        )
-                        if execute_notebooks:
-                            loaded_notebook = get_notebook(
-                                nb_path,
-                                execute=True,
-                            )
-                            print('Notebook has been executed')
-                            notebook_executed = is_notebook_fully_executed(
-                                loaded_notebook
-                            )
-                        else:
-                            print(
-                                "Notebook execution skipped since"
-                                " execute_notebooks is False."
-                            )
-                    else:
-                        print(
-                            f"Notebook {filename} is unchanged and already"
-                            " fully executed"
-                        )
-                # if the file is new (unhashed) or has been changed, execute
-                # the notebook and update the hash dict
+        needs_execution = False
+
+        # for cases where the hash has not changed
+        if skip_notebook:
+            print(
+                f"Notebook '{filename}' has been flagged to be"
+                " skipped. Execution will not be attempted for"
+                " this notebook."
+            )
+        elif (filename in notebook_hashes) and \
+                (notebook_hashes[filename] == current_hash):
+
+            # check if notebook has been fully executed
+            if not notebook_executed:
+                print(
+                    f"Warning: Notebook {filename} has not been"
+                    " fully executed."
+                )
+                if execute_notebooks:
+                    needs_execution = True
                 else:
                     print(
-                        f"Notebook {filename} is new or has been updated and"
-                        " needs to be executed"
+                        "Notebook execution skipped since"
+                        " execute_notebooks is False."
                     )
-                    if execute_notebooks:
-                        loaded_notebook = get_notebook(
-                            nb_path,
-                            execute=True,
-                        )
-                        print(
-                            "Notebook has been executed"
-                        )
-                        notebook_executed = is_notebook_fully_executed(
-                            loaded_notebook
-                        )
+            else:
+                print(
+                    f"Notebook {filename} is unchanged and already"
+                    " fully executed"
+                )
+        # if the file is new (unhashed) or has been changed, execute
+        # the notebook and update the hash dict
+        else:
+            print(
+                f"Notebook {filename} is new or has been updated and"
+                " needs to be executed"
+            )
+            if execute_notebooks:
+                needs_execution = True
+            else:
+                print(
+                    "Skipping notebook execution since"
+                    " execute_notebook is False"
+                )
 
-                    else:
-                        print(
-                            "Skipping notebook execution since"
-                            " execute_notebook is False"
-                        )
+        # reuse the executed notebook from the execution cache when
+        # this exact notebook was executed before in this environment
+        cached_notebook = None
+        if needs_execution and notebook_cache is not None:
+            cached_notebook = notebook_cache.load(current_hash)
+            if cached_notebook is not None:
+                print(
+                    f"Restored executed notebook {filename} from the"
+                    " execution cache"
+                )
+                needs_execution = False
+
+        if needs_execution and notebook is None:
+            with timed("notebook loading", item=os.path.relpath(nb_path)):
+                notebook, _ = read_notebook(nb_path)
+
+        # update the hash dictionary
+        updated_hashes[filename] = current_hash
+
+        notebooks.append({
+            "filename": filename,
+            "root": root,
+            "nb_path": nb_path,
+            "skip_notebook": skip_notebook,
+            "notebook_executed": notebook_executed,
+            "needs_execution": needs_execution,
+            "current_hash": current_hash,
+            "cached_notebook": cached_notebook,
+            "notebook": notebook,
+        })
+
+    # ----------------------------------------
+    # execute notebooks, optionally in parallel
+    # ----------------------------------------
+    executed_notebooks = execute_notebooks_in_parallel(
+        [nb["nb_path"] for nb in notebooks if nb["needs_execution"]],
+        jobs=jobs,
+        log_folder=log_folder,
+        cache_folder=cache_folder,
+        notebooks={
+            nb["nb_path"]: nb["notebook"]
+            for nb in notebooks if nb["needs_execution"]
+        },
+        warm_kernel_paths={
+            nb["nb_path"]
+            for nb in notebooks
+            if warm_kernels and nb["filename"] not in fresh_kernel_notebooks
+        },
+        resources={
+            nb["nb_path"]: get_notebook_resources(
+                nb["filename"],
+                nb["notebook"],
+                resource_config,
+            )
+            for nb in notebooks if nb["needs_execution"]
+        },
+        budget=resource_budget,
+        durations=durations,
+    )
+    if durations is not None:
+        durations.save()
+    if notebook_cache is not None:
+        for nb in notebooks:
+            if nb["nb_path"] in executed_notebooks:
+                notebook_cache.save(
+                    nb["current_hash"],
+                    executed_notebooks[nb["nb_path"]],
+                )
+    if cache_folder and executed_notebooks:
+        # keep the cell execution cache, which is restored in CI, from
+        # growing forever
+        CellExecutionCache(os.path.join(cache_folder, "cells")).prune()
+
+    # ----------------------------------------
+    # convert notebooks to html and json
+    # ----------------------------------------
+    # cell timings of the notebooks executed by this build
+    notebook_timings = {}
+    regressions = []
+    for nb in notebooks:
+        filename = nb["filename"]
+        root = nb["root"]
+        nb_path = nb["nb_path"]
+        relative_nb_path = os.path.relpath(nb_path)
+        notebook_executed = nb["notebook_executed"]
+
+        loaded_notebook = executed_notebooks.get(
+            nb_path,
+            nb["cached_notebook"],
+        )
+        if loaded_notebook is not None:
+            notebook_executed = is_notebook_fully_executed(
+                loaded_notebook
+            )
 
-                # update the hash dictionary
-                updated_hashes[filename] = current_hash
+        output_json = os.path.join(
+            root, f"{os.path.splitext(filename)[0]}.json"
+        )
+        output_file = os.path.join(
+            root, f"{os.path.splitext(filename)[0]}.html"
+        )
 
-                # extract and process the html from the notebook
-                html_content = extract_html_from_notebook(
-                    loaded_notebook,
-                    root,
-                    filename,
-                    use_base64,
+        # skip conversion if the notebook was not executed and
+        # is unchanged since its outputs were last generated; the
+        # figures of the notebook must also be recorded in the image
+        # store, so that they are not garbage collected
+        if manifest is not None:
+            input_hashes = {
+                "notebook": manifest.hash_file(nb_path),
+            }
+            figures_recorded = image_store is None or \
+                image_store.has_references(nb_path)
+            if loaded_notebook is None and figures_recorded and \
+                    manifest.is_up_to_date(
+                        output_json,
+                        input_hashes,
+                        extra_outputs=[output_file] if write_html else [],
+                    ):
+                print(
+                    f"Notebook {filename} is unchanged; skipping"
+                    " conversion"
                 )
+                continue
+
+        # use the notebook read for hashing, without executing it
+        if loaded_notebook is None:
+            loaded_notebook = nb["notebook"]
+        if loaded_notebook is None:
+            with timed("notebook loading", item=relative_nb_path):
+                loaded_notebook, _ = read_notebook(nb_path)
+
+        # extract and process the html from the notebook
+        with timed("notebook html extraction", item=relative_nb_path):
+            if image_store is not None:
+                image_store.clear_references(nb_path)
+                remove_figure_folder(root, filename)
+            html_content = extract_html_from_notebook(
+                loaded_notebook,
+                root,
+                filename,
+                use_base64,
+                image_store=image_store,
+            )
 
-                # optionally write the converted notebook to a
-                # standalone html file
-                if write_html:
-                    output_file = os.path.join(
-                        root, f"{os.path.splitext(filename)[0]}.html"
-                    )
-                    with open(output_file, "w", encoding="utf-8") as f:
-                        f.write("<html><body>\n")
-                        f.write(html_content)
-                        f.write("\n</body></html>")
-
-                # ----------------------------------------
-                # generated structured json output
-                # ----------------------------------------
-                # Note: this section pertains to a planned enhancement
-                # to enable inserting sections of a notebook into an
-                # html file by specifing the headers to include; e.g.,
-                # including [[notebook][start header][end header]] in your
-                # .md file would inject only the .html for those header
-                # sections into your html output file
-
-                nb_html_json = html_to_json(
-                    html_content,
-                    filename,
+        # optionally write the converted notebook to a
+        # standalone html file
+        if write_html:
+            with timed("writes", item=relative_nb_path):
+                write_if_changed(
+                    output_file,
+                    "<html><body>\n" + html_content + "\n</body></html>",
                 )
 
-                # Add execution status directly to json output
-                nb_html_json = {
-                    "full_executed": notebook_executed,
-                    **nb_html_json,
-                }
+        # ----------------------------------------
+        # generated structured json output
+        # ----------------------------------------
+        # Note: this section pertains to a planned enhancement
+        # to enable inserting sections of a notebook into an
+        # html file by specifing the headers to include; e.g.,
+        # including [[notebook][start header][end header]] in your
+        # .md file would inject only the .html for those header
+        # sections into your html output file
+
+        with timed("notebook html extraction", item=relative_nb_path):
+            nb_html_json = html_to_json(
+                html_content,
+                filename,
+            )
+
+        # keep the cell timings of the last run when the notebook was
+        # not executed, and compare them to the timings of a new run
+        cell_timings = get_cell_timings(loaded_notebook)
+        if not cell_timings or nb_path in executed_notebooks:
+            previous_timings = load_cell_timings(output_json)
+            if not cell_timings:
+                cell_timings = previous_timings
+            else:
+                notebook_timings[filename] = cell_timings
+                if cell_regression_budget is not None:
+                    regressions += [
+                        (filename, timing, previous)
+                        for timing, previous in find_regressions(
+                            cell_timings,
+                            previous_timings,
+                            cell_regression_budget,
+                        )
+                    ]
 
-                output_json = os.path.join(
-                    root, f"{os.path.splitext(filename)[0]}.json"
-                )
-                with open(output_json, "w") as f:
-                    json.dump(nb_html_json, f, indent=4)
-                # ----------------------------------------
+        # Add execution status directly to json output; it must stay
+        # first, see notebook_has_json_output
+        nb_html_json = {
+            "full_executed": notebook_executed,
+            **({"cell_timings": cell_timings} if cell_timings else {}),
+            **nb_html_json,
+        }
 
-                print(
-                    f"Successfully converted '{filename}'to html"
-                )
+        with timed("writes", item=relative_nb_path):
+            write_if_changed(output_json, json.dumps(nb_html_json, indent=4))
 
-                if not skip_notebook and not notebook_executed:
-                    print(
-                        f"Warning: the html and json outputs for '{filename}'"
-                        " may be incomplete."
-                        "\nPlease re-run the script with"
-                        " 'execute_notebooks=True' to ensure that the"
-                        " notebook outputs are correct."
-                    )
+        if manifest is not None:
+            manifest.record(output_json, input_hashes)
+        # ----------------------------------------
+
+        print(
+            f"Successfully converted '{filename}'to html"
+        )
+
+        if not nb["skip_notebook"] and not notebook_executed:
+            print(
+                f"Warning: the html and json outputs for '{filename}'"
+                " may be incomplete."
+                "\nPlease re-run the script with"
+                " 'execute_notebooks=True' to ensure that the"
+                " notebook outputs are correct."
+            )
 
-    # save updated hashes
+    # remove stored figures that are no longer used by any notebook
+    if image_store is not None:
+        n_removed = image_store.collect_garbage(notebook_paths)
+        if n_removed:
+            print(f"\nRemoved {n_removed} unused notebook figures")
+
+    # merge the updated hashes into the saved hashes; the file is
+    # re-read so that entries for notebooks outside the input folder
+    # are preserved
+    merged_hashes = load_notebook_hashes(hash_path)
+    merged_hashes.update(updated_hashes)
     save_notebook_hashes(
-        updated_hashes,
+        merged_hashes,
         hash_path,
     )
+    if stat_cache is not None:
+        stat_cache.save()
+
+    print_slowest_cells(notebook_timings)
+    if regressions:
+        raise RuntimeError(
+            "Notebook cells got slower than the budget of"
+            f" {cell_regression_budget}x their last recorded time:\n"
+            + "\n".join(
+                f"  {filename} cell {timing['index']}:"
+                f" {previous['duration']:.2f}s -> {timing['duration']:.2f}s"
+                for filename, timing, previous in regressions
+            )
+        )
 
     return
 
@@ -617,4 +1335,44 @@ def test_nb_conversion(input_folder=None):
     )
 
 
+def test_markdown_batching(input_folder=None):
+    """
+    Check that batched markdown conversion produces output identical to
+    converting each markdown cell separately for every notebook in the
+    input folder. Run by `make check`.
+    """
+
+    if not input_folder:
+        input_folder = os.path.join(
+            os.getcwd().split('scripts')[0], 'content'
+        )
+
+    checked_notebooks = []
+    mismatched_notebooks = []
+    for root, list_folders, list_files in os.walk(input_folder):
+        for filename in sorted(list_files):
+            if filename.endswith(".ipynb"):
+                checked_notebooks.append(filename)
+                notebook = get_notebook(
+                    os.path.join(root, filename),
+                    execute=False,
+                )
+                outputs = [
+                    extract_html_from_notebook(
+                        notebook,
+                        root,
+                        filename,
+                        use_base64=True,
+                        batch_markdown=batch_markdown,
+                    )
+                    for batch_markdown in (True, False)
+                ]
+                if outputs[0] != outputs[1]:
+                    mismatched_notebooks.append(filename)
+
+    assert checked_notebooks, f"No notebooks found in {input_folder}"
+    assert not mismatched_notebooks, \
+        f"Batched markdown conversion differs for: {mismatched_notebooks}"
+
+
 # _ = test_nb_conversion()
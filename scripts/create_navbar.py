@@ -1,13 +1,18 @@
 # %% ######################################################################
 import os
 import json
+from scripts.content_model import ContentModel
+from scripts.output_files import write_if_changed
 
 # %% ######################################################################
 
 
-def generate_navbar_html():
+def generate_navbar_html(content_model=None):
     """Function to generate the navbar from the structure specified
-       in the index.json file"""
+       in the page index of the content model; content/ is scanned if
+       no content model is provided. Also returns the links and titles
+       of the pages in navbar order, which are saved to
+       templates/ordered_page_links.json."""
 
     indent = '\t\t'
 
@@ -41,35 +46,9 @@ def generate_navbar_html():
         f'\n{indent}</div>' + \
         f'\n{indent}</a>'
 
-    # load page index .json file
-    index_path = os.getcwd() + "/index.json"
-
-    with open(index_path, 'r') as f:
-        json_page_index = json.load(f)
-
-    def get_absolute_paths(path=None):
-        """Get paths to all .md pages to be converted to html"""
-        md_pages = {}
-        if path is None:
-            path = os.path.join(os.getcwd(), "content")
-
-        directories = os.listdir(path)
-        for item in directories:
-            item_path = os.path.join(path, item)
-            if os.path.isdir(item_path):
-                # add items from new dict into md_pages
-                md_pages.update(get_absolute_paths(item_path))
-            else:
-                if not item == "README.md" and item.endswith(".md"):
-                    # get the relative path for the web content only
-                    location = item_path.split(os.getcwd()+os.sep)[1]
-                    location = location.split(item)[0]
-
-                    page = item.split("_", 1)[1]
-                    page = page.split(".md")[0] + ".html"
-
-                    md_pages[item] = '/website_redesign/' + location + page
-        return md_pages
+    if content_model is None:
+        content_model = ContentModel()
+    json_page_index = content_model.get_page_index()
 
     def create_page_link(file, label, page_paths, indent):
         file_path = page_paths[file]
@@ -87,7 +66,7 @@ def generate_navbar_html():
 
     def build_navbar(json_page_index):
         navbar_html = ''
-        page_paths = get_absolute_paths()
+        page_paths = content_model.get_page_links()
         ordered_links = []
         ordered_pages = []
         for section, contents in json_page_index.items():
@@ -121,27 +100,28 @@ def generate_navbar_html():
                 navbar_html += f'\n{indent}\t</div>'
                 navbar_html += f'\n{indent}</div>'
 
-            # save ordered page links
-            out_path = os.getcwd() + "/templates/ordered_page_links.json"
-            ordered_page_links = {}
-            ordered_page_links['links'] = ordered_links
-            ordered_page_links['titles'] = ordered_pages
-
-            with open(out_path, 'w', encoding='utf-8') as f:
-                json.dump(
-                    ordered_page_links,
-                    f,
-                    ensure_ascii=False,
-                    indent=4,
-                )
+        # save ordered page links
+        out_path = os.getcwd() + "/templates/ordered_page_links.json"
+        ordered_page_links = {}
+        ordered_page_links['links'] = ordered_links
+        ordered_page_links['titles'] = ordered_pages
+
+        write_if_changed(
+            out_path,
+            json.dumps(
+                ordered_page_links,
+                ensure_ascii=False,
+                indent=4,
+            ),
+        )
 
-        return navbar_html, ordered_links
+        return navbar_html, ordered_page_links
 
-    navbar_html, ordered_links = build_navbar(json_page_index)
+    navbar_html, ordered_page_links = build_navbar(json_page_index)
     html += navbar_html
     html += "\n\t<div style='height: 30px;'></div>"
     html += '\n\t</div>'
-    return html, ordered_links
+    return html, ordered_page_links
 
 
 # print(generate_navbar_html())
@@ -0,0 +1,222 @@
+# %% ######################################################################
+import os
+import threading
+import functools
+import http.server
+from scripts.content_model import SITE_URL_PREFIX
+
+# %% ######################################################################
+
+# endpoint streaming reload events to open pages
+LIVE_RELOAD_PATH = "/__livereload"
+
+# snippet injected into served html pages; it is never written to disk
+LIVE_RELOAD_SCRIPT = (
+    "<script>"
+    f"new EventSource('{LIVE_RELOAD_PATH}')"
+    ".onmessage = function () { location.reload(); };"
+    "</script>"
+)
+
+# extensions of the content files whose changes trigger a rebuild
+WATCHED_CONTENT_EXTENSIONS = (".md", ".ipynb")
+# generated files that must not trigger a rebuild
+IGNORED_TEMPLATES = ("ordered_page_links.json",)
+
+
+def get_watched_files(site_path):
+    """
+    Get the modification times of the source files of the site: the
+    markdown pages and notebooks in content/, the files in content/assets
+    and templates/, index.json and the bibliography.
+
+    Returns
+    -------
+    snapshot : dict
+        Mapping of file paths to modification times, in nanoseconds
+    """
+    paths = []
+
+    content_path = os.path.join(site_path, "content")
+    assets_path = os.path.join(content_path, "assets")
+    for root, folders, files in os.walk(content_path):
+        for filename in files:
+            if root.startswith(assets_path) or \
+                    filename.endswith(WATCHED_CONTENT_EXTENSIONS):
+                paths.append(os.path.join(root, filename))
+
+    templates_path = os.path.join(site_path, "templates")
+    for filename in os.listdir(templates_path):
+        if filename not in IGNORED_TEMPLATES:
+            paths.append(os.path.join(templates_path, filename))
+
+    paths.append(os.path.join(site_path, "index.json"))
+    paths.append(os.path.join(site_path, "textbook-bibliography.bib"))
+
+    snapshot = {}
+    for path in paths:
+        try:
+            snapshot[path] = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return snapshot
+
+
+def get_changed_files(old_snapshot, new_snapshot):
+    """Get the sorted paths of files that were added, removed or modified
+    between two snapshots"""
+    return sorted(
+        path
+        for path in old_snapshot.keys() | new_snapshot.keys()
+        if old_snapshot.get(path) != new_snapshot.get(path)
+    )
+
+
+class _LiveReloadHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve the site folder under SITE_URL_PREFIX, inject the live reload
+    script into html pages, and stream reload events"""
+
+    def __init__(self, *args, dev_server=None, **kwargs):
+        self.dev_server = dev_server
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        # keep the terminal for build output
+        pass
+
+    def translate_path(self, path):
+        # page links are absolute and start with the site prefix
+        if path.startswith(SITE_URL_PREFIX):
+            path = "/" + path[len(SITE_URL_PREFIX):]
+        return super().translate_path(path)
+
+    def do_GET(self):
+        if self.path == LIVE_RELOAD_PATH:
+            self._stream_reload_events()
+            return
+
+        file_path = self.translate_path(self.path.split("?", 1)[0])
+        if os.path.isdir(file_path):
+            file_path = os.path.join(file_path, "index.html")
+        if not file_path.endswith(".html") or not os.path.isfile(file_path):
+            super().do_GET()
+            return
+
+        with open(file_path, "rb") as f:
+            page = f.read()
+        if b"</body>" in page:
+            page = page.replace(
+                b"</body>",
+                LIVE_RELOAD_SCRIPT.encode("utf-8") + b"</body>",
+                1,
+            )
+        else:
+            page += LIVE_RELOAD_SCRIPT.encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(page)
+
+    def _stream_reload_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+
+        version = self.dev_server.version
+        try:
+            while not self.dev_server.closed:
+                version_changed = self.dev_server.wait_for_reload(
+                    version,
+                    timeout=15,
+                )
+                if self.dev_server.closed:
+                    break
+                if version_changed:
+                    version = self.dev_server.version
+                    self.wfile.write(b"data: reload\n\n")
+                else:
+                    # keep the connection alive
+                    self.wfile.write(b": ping\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class DevServer:
+    """
+    Local HTTP server for previewing the site, which reloads open pages
+    when notify_reload is called after a rebuild.
+
+    Arguments
+    ---------
+    site_path : str
+        Root folder of the site
+    host : str
+        Address to listen on
+    port : int
+        Port to listen on
+    """
+
+    def __init__(
+            self,
+            site_path,
+            host="127.0.0.1",
+            port=8000,
+            ):
+        self.site_path = site_path
+        self.host = host
+        self.port = port
+        self.version = 0
+        self.closed = False
+        self._condition = threading.Condition()
+        self._server = None
+
+    def start(self):
+        """Start serving in a background thread"""
+        handler = functools.partial(
+            _LiveReloadHandler,
+            directory=self.site_path,
+            dev_server=self,
+        )
+        self._server = http.server.ThreadingHTTPServer(
+            (self.host, self.port),
+            handler,
+        )
+        self._server.daemon_threads = True
+        thread = threading.Thread(
+            target=self._server.serve_forever,
+            daemon=True,
+        )
+        thread.start()
+
+    def get_url(self, link=SITE_URL_PREFIX):
+        """Get the full url of a site link"""
+        return f"http://{self.host}:{self.port}{link}"
+
+    def wait_for_reload(self, version, timeout=None):
+        """Wait until the site is rebuilt after the given version. Returns
+        False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self.version != version or self.closed,
+                timeout=timeout,
+            )
+
+    def notify_reload(self):
+        """Reload all open pages"""
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+
+    def close(self):
+        """Stop the server and close the reload streams"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
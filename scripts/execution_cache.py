@@ -0,0 +1,251 @@
+# %% ######################################################################
+import os
+import sys
+import json
+import hashlib
+import importlib.metadata
+
+# %% ######################################################################
+
+# packages whose versions can change the outputs of executed notebooks
+FINGERPRINT_PACKAGES = [
+    "hnn_core",
+    "NEURON",
+    "numpy",
+    "scipy",
+    "matplotlib",
+    "mne",
+]
+
+# size above which the least recently used cell outputs are removed from
+# the cell execution cache
+MAX_CELL_CACHE_SIZE_MB = 500
+
+
+def get_environment_fingerprint(kernel_name="python3"):
+    """
+    Generate a hash describing the execution environment: the kernel
+    name, the Python version and the versions of the packages used by the
+    notebooks. Cached outputs are only reused in a matching environment.
+    """
+    versions = {
+        "kernel": kernel_name,
+        "python": sys.version,
+    }
+    for package in FINGERPRINT_PACKAGES:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps(versions, sort_keys=True).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class CellExecutionCache:
+    """
+    Cache of code cell outputs keyed on the cumulative hash of all code
+    cells up to and including each cell, plus the kernel name and the
+    environment fingerprint. A cell's cached outputs are therefore only
+    reused when every code cell before it is also unchanged.
+
+    Arguments
+    ---------
+    cache_folder : str
+        Folder in which cached cell outputs are stored
+    kernel_name : str
+        Name of the kernel used to execute notebooks
+    """
+
+    def __init__(
+            self,
+            cache_folder,
+            kernel_name="python3",
+            ):
+        self.cache_folder = cache_folder
+        self.kernel_name = kernel_name
+        self.fingerprint = get_environment_fingerprint(kernel_name)
+
+    def get_cell_keys(self, notebook):
+        """Get the cumulative cache key for each code cell"""
+        hasher = hashlib.sha256()
+        hasher.update(self.fingerprint.encode("utf-8"))
+
+        keys = []
+        for cell in notebook.cells:
+            if cell.cell_type == "code":
+                hasher.update(cell.source.encode("utf-8"))
+                # separate cells so that moving a line between two
+                # cells changes the key
+                hasher.update(b"\0")
+                keys.append(hasher.copy().hexdigest())
+        return keys
+
+    def _get_cache_path(self, key):
+        return os.path.join(self.cache_folder, key[:2], f"{key}.json")
+
+    def load(self, key):
+        """Load the cached outputs for a cell, or None if not cached or
+        if the cached file cannot be read"""
+        cache_path = self._get_cache_path(key)
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # mark the entry as used, for prune
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return entry
+
+    def save(self, key, cell):
+        """Save the outputs of an executed code cell"""
+        cache_path = self._get_cache_path(key)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # write to a temporary file first so that an interrupted build or
+        # a parallel worker never leaves a partial entry in the cache
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "execution_count": cell.execution_count,
+                    "outputs": cell.outputs,
+                },
+                f,
+            )
+        os.replace(temp_path, cache_path)
+
+    def prune(self, max_size_mb=MAX_CELL_CACHE_SIZE_MB):
+        """
+        Remove the least recently used cell outputs until the cache is
+        smaller than max_size_mb, along with temporary files left by
+        interrupted builds.
+
+        Returns
+        -------
+        n_removed : int
+            Number of removed files
+        """
+        entries = []
+        n_removed = 0
+        for root, folders, files in os.walk(self.cache_folder):
+            for filename in files:
+                file_path = os.path.join(root, filename)
+                try:
+                    if filename.endswith(".tmp"):
+                        os.remove(file_path)
+                        n_removed += 1
+                        continue
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file_path))
+
+        cache_size = sum(size for _, size, _ in entries)
+        max_size = max_size_mb * 1024**2
+        for _, size, file_path in sorted(entries):
+            if cache_size <= max_size:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                continue
+            cache_size -= size
+            n_removed += 1
+        return n_removed
+
+    def restore_notebook(self, notebook):
+        """
+        Restore the outputs of every code cell from the cache.
+
+        Returns
+        -------
+        restored : bool
+            True if all code cells were found in the cache. The notebook
+            is left unmodified otherwise.
+        """
+        import nbformat
+
+        code_cells = [
+            cell for cell in notebook.cells if cell.cell_type == "code"
+        ]
+        entries = []
+        for key in self.get_cell_keys(notebook):
+            entry = self.load(key)
+            if entry is None:
+                return False
+            entries.append(entry)
+
+        for cell, entry in zip(code_cells, entries):
+            cell.execution_count = entry["execution_count"]
+            cell.outputs = [
+                nbformat.from_dict(output) for output in entry["outputs"]
+            ]
+        return True
+
+    def save_notebook(self, notebook):
+        """Save the outputs of every executed code cell"""
+        code_cells = [
+            cell for cell in notebook.cells if cell.cell_type == "code"
+        ]
+        for cell, key in zip(code_cells, self.get_cell_keys(notebook)):
+            if cell.execution_count is not None:
+                self.save(key, cell)
+
+
+class NotebookExecutionCache:
+    """
+    Content-addressed cache of executed notebooks, keyed on the hash of
+    the cleaned notebook (see hash_notebook) and the environment
+    fingerprint. The cache folder can be saved and restored between CI
+    runs so that unchanged notebooks are not executed again, even on a
+    fresh checkout.
+
+    Arguments
+    ---------
+    cache_folder : str
+        Folder in which executed notebooks are stored
+    kernel_name : str
+        Name of the kernel used to execute notebooks
+    """
+
+    def __init__(
+            self,
+            cache_folder,
+            kernel_name="python3",
+            ):
+        self.cache_folder = cache_folder
+        self.fingerprint = get_environment_fingerprint(kernel_name)
+
+    def _get_cache_path(self, notebook_hash):
+        hasher = hashlib.sha256()
+        hasher.update(notebook_hash.encode("utf-8"))
+        hasher.update(self.fingerprint.encode("utf-8"))
+        key = hasher.hexdigest()
+        return os.path.join(self.cache_folder, f"{key}.ipynb")
+
+    def load(self, notebook_hash):
+        """Load the executed notebook, or None if it is not cached"""
+        import nbformat
+
+        cache_path = self._get_cache_path(notebook_hash)
+        if not os.path.exists(cache_path):
+            return None
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return nbformat.read(f, as_version=4)
+
+    def save(self, notebook_hash, notebook):
+        """Save an executed notebook"""
+        import nbformat
+
+        cache_path = self._get_cache_path(notebook_hash)
+        os.makedirs(self.cache_folder, exist_ok=True)
+        # write to a temporary file first so that an interrupted build
+        # never leaves a partial notebook in the cache
+        temp_path = f"{cache_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            nbformat.write(notebook, f)
+        os.replace(temp_path, cache_path)
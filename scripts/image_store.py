@@ -0,0 +1,131 @@
+# %% ######################################################################
+import os
+import json
+import base64
+import hashlib
+from scripts.output_files import get_output_counter, write_if_changed
+
+# %% ######################################################################
+
+# file of the store folder recording the images used by each notebook; it
+# is a dotfile so that it is not published with the site
+REFERENCES_FILE = ".references.json"
+
+
+class ImageStore:
+    """
+    Content-addressed store for the figures of notebook outputs.
+
+    Each distinct image is written once, to a file named by the hash of
+    its contents, so that a figure shared by several notebooks is stored
+    once and re-converting a notebook does not rewrite its figures. The
+    images referenced by each notebook are recorded in the store, so
+    that images no longer referenced by any notebook can be removed.
+
+    Arguments
+    ---------
+    folder : str
+        Folder of the stored images
+    site_path : str
+        Root folder of the site; notebooks are recorded by their path
+        relative to it
+    """
+
+    def __init__(
+            self,
+            folder,
+            site_path=None,
+            ):
+        self.folder = folder
+        self.site_path = site_path or os.getcwd()
+        self.references = {}
+
+        references_path = os.path.join(folder, REFERENCES_FILE)
+        if os.path.exists(references_path):
+            with open(references_path, "r") as f:
+                self.references = json.load(f)
+
+    def _key(self, notebook_path):
+        return os.path.relpath(notebook_path, self.site_path) \
+            .replace(os.sep, "/")
+
+    def has_references(self, notebook_path):
+        """Check whether the images of a notebook are recorded"""
+        return self._key(notebook_path) in self.references
+
+    def clear_references(self, notebook_path):
+        """Forget the images of a notebook before converting it again"""
+        self.references[self._key(notebook_path)] = []
+
+    def add(
+            self,
+            img_data,
+            notebook_path,
+            extension=".png",
+            ):
+        """
+        Store a base64 encoded image used by a notebook.
+
+        Returns
+        -------
+        image_path : str
+            Path of the stored image
+        """
+        content = base64.b64decode(img_data)
+        # the name has the same length as the fingerprints of the --dist
+        # stage, so that stored images are not fingerprinted again
+        image_name = hashlib.sha256(content).hexdigest()[:10] + extension
+        image_path = os.path.join(self.folder, image_name)
+
+        # stored images never change, so they are not compared again
+        if os.path.exists(image_path):
+            get_output_counter().record(False)
+        else:
+            write_if_changed(image_path, content)
+
+        images = self.references.setdefault(self._key(notebook_path), [])
+        if image_name not in images:
+            images.append(image_name)
+        return image_path
+
+    def collect_garbage(self, notebook_paths):
+        """
+        Remove the images that are not referenced by any of the given
+        notebooks, and save the references of the store.
+
+        Arguments
+        ---------
+        notebook_paths : list of str
+            All notebooks of the site; references of other notebooks,
+            e.g. deleted ones, are dropped
+
+        Returns
+        -------
+        n_removed : int
+            Number of images removed
+        """
+        keys = {self._key(path) for path in notebook_paths}
+        self.references = {
+            key: images
+            for key, images in sorted(self.references.items())
+            if key in keys
+        }
+        referenced = {
+            image
+            for images in self.references.values()
+            for image in images
+        }
+
+        n_removed = 0
+        if os.path.isdir(self.folder):
+            for file_name in os.listdir(self.folder):
+                if file_name.startswith(".") or file_name in referenced:
+                    continue
+                os.remove(os.path.join(self.folder, file_name))
+                n_removed += 1
+
+        write_if_changed(
+            os.path.join(self.folder, REFERENCES_FILE),
+            json.dumps(self.references, indent=4),
+        )
+        return n_removed
@@ -0,0 +1,280 @@
+# %% ######################################################################
+import os
+import contextlib
+import multiprocessing.util
+
+# %% ######################################################################
+
+# modules imported when a kernel is started, so that notebooks executed
+# in the kernel do not pay for importing them; modules that are not
+# installed are skipped
+PRELOADED_MODULES = [
+    "numpy",
+    "scipy",
+    "matplotlib.pyplot",
+    "mne",
+    "hnn_core",
+    "hnn_core.network_builder",
+]
+
+# run once when a kernel is started: import the preloaded modules, load
+# the NEURON mechanisms of hnn_core, and record the state that is
+# restored between notebooks in a private module
+WARMUP_CODE = """
+def _warm_kernel():
+    import sys
+    import types
+    import sysconfig
+    import importlib
+
+    for module_name in {preloaded_modules!r}:
+        try:
+            importlib.import_module(module_name)
+        except Exception:
+            pass
+    try:
+        from hnn_core.network_builder import load_custom_mechanisms
+        load_custom_mechanisms()
+    except Exception:
+        pass
+
+    state = types.ModuleType("_kernel_pool_state")
+    state.modules = set(sys.modules)
+    state.library_paths = tuple(
+        path for path in {{
+            sys.prefix,
+            sys.base_prefix,
+            *sysconfig.get_paths().values(),
+        }}
+        if path
+    )
+    state.path = list(sys.path)
+    if "matplotlib" in sys.modules:
+        state.rc_params = dict(sys.modules["matplotlib"].rcParams)
+    sys.modules["_kernel_pool_state"] = state
+
+_warm_kernel()
+del _warm_kernel
+"""
+
+# run before each notebook: clear the namespace of the previous notebook
+# and start a new history session, which restarts the execution count;
+# forget modules imported from outside the Python installation (e.g.
+# helper modules next to a notebook), close figures, restore the
+# matplotlib settings and change to the folder of the notebook
+RESET_CODE = """
+get_ipython().reset(new_session=True)
+
+def _reset_kernel():
+    import os
+    import sys
+    import warnings
+
+    state = sys.modules["_kernel_pool_state"]
+    for module_name, module in list(sys.modules.items()):
+        module_file = getattr(module, "__file__", None)
+        if module_name not in state.modules and module_file and \\
+                not module_file.startswith(state.library_paths):
+            del sys.modules[module_name]
+    sys.path[:] = state.path
+
+    if "matplotlib.pyplot" in sys.modules:
+        sys.modules["matplotlib.pyplot"].close("all")
+    if hasattr(state, "rc_params"):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            sys.modules["matplotlib"].rcParams.update(state.rc_params)
+
+    os.chdir({cwd!r})
+
+_reset_kernel()
+del _reset_kernel
+"""
+
+
+class WarmKernel:
+    """
+    A kernel with the preloaded modules imported, that is reset before
+    each notebook it executes.
+
+    Arguments
+    ---------
+    kernel_name : str
+        Name of the Jupyter kernel
+    timeout : int
+        Maximum time to start and warm up the kernel, in seconds
+    stdout, stderr : int | None
+        File descriptors the kernel process writes its own output to,
+        instead of those of the current process
+    """
+
+    def __init__(
+            self,
+            kernel_name="python3",
+            timeout=600,
+            stdout=None,
+            stderr=None,
+            ):
+        from jupyter_client.manager import AsyncKernelManager
+        from jupyter_core.utils import run_sync
+
+        self.timeout = timeout
+        # an async manager is awaited directly by ExecutePreprocessor; the
+        # methods of a blocking manager would be run on a background
+        # event loop thread, which hangs worker processes forked after it
+        # was started
+        self.km = AsyncKernelManager(kernel_name=kernel_name)
+        run_sync(self.km.start_kernel)(stdout=stdout, stderr=stderr)
+        try:
+            self._run(WARMUP_CODE.format(preloaded_modules=PRELOADED_MODULES))
+        except Exception:
+            self.shutdown()
+            raise
+
+    def _run(self, code):
+        """Run code in the kernel without recording it in its history"""
+        from jupyter_core.utils import run_sync
+
+        run_sync(self._async_run)(code)
+
+    async def _async_run(self, code):
+        # a new client is used each time, since the shell channel of a
+        # client left open while ExecutePreprocessor uses the kernel
+        # stops receiving replies
+        kc = self.km.client()
+        kc.start_channels()
+        try:
+            await kc.wait_for_ready(timeout=self.timeout)
+            reply = await kc.execute_interactive(
+                code,
+                silent=True,
+                store_history=False,
+                timeout=self.timeout,
+            )
+        finally:
+            kc.stop_channels()
+        if reply["content"]["status"] != "ok":
+            raise RuntimeError(
+                "Failed to prepare the kernel:"
+                f" {reply['content'].get('evalue', '')}"
+            )
+
+    def reset(self, cwd):
+        """Clear the state left by the previous notebook"""
+        self._run(RESET_CODE.format(cwd=os.path.abspath(cwd)))
+
+    def is_alive(self):
+        from jupyter_core.utils import run_sync
+
+        return run_sync(self.km.is_alive)()
+
+    def shutdown(self):
+        """Stop the kernel"""
+        from jupyter_core.utils import run_sync
+
+        if self.km.has_kernel:
+            run_sync(self.km.shutdown_kernel)(now=True)
+
+
+class KernelPool:
+    """
+    Pool of warm kernels reused across notebook executions, so that only
+    the first notebook executed by a process pays for starting a kernel
+    and importing hnn_core, NEURON and the other preloaded modules.
+
+    Kernels are reset before each notebook, and discarded when a
+    notebook fails, since the kernel may then be busy or in an unknown
+    state. Since kernels outlive the notebook that started them, they
+    write their own output to the stdout and stderr that the process had
+    when the pool was created, rather than to a notebook's log.
+
+    Arguments
+    ---------
+    kernel_name : str
+        Name of the Jupyter kernel
+    max_idle : int
+        Maximum number of idle kernels kept for reuse
+    """
+
+    def __init__(
+            self,
+            kernel_name="python3",
+            max_idle=1,
+            ):
+        self.kernel_name = kernel_name
+        self.max_idle = max_idle
+        self._idle_kernels = []
+        self._output_fds = (os.dup(1), os.dup(2))
+
+    @contextlib.contextmanager
+    def kernel(self, cwd):
+        """
+        Get a warm kernel that is reset to the given working directory,
+        and return it to the pool after use.
+
+        Yields
+        ------
+        km : AsyncKernelManager
+            Manager of the kernel, to be passed to ExecutePreprocessor
+        """
+        kernel = None
+        while self._idle_kernels and kernel is None:
+            kernel = self._idle_kernels.pop()
+            if not kernel.is_alive():
+                kernel.shutdown()
+                kernel = None
+        if kernel is None:
+            kernel = WarmKernel(
+                self.kernel_name,
+                stdout=self._output_fds[0],
+                stderr=self._output_fds[1],
+            )
+
+        try:
+            kernel.reset(cwd)
+            yield kernel.km
+        except BaseException:
+            kernel.shutdown()
+            raise
+        if len(self._idle_kernels) < self.max_idle:
+            self._idle_kernels.append(kernel)
+        else:
+            kernel.shutdown()
+
+    def shutdown(self):
+        """Stop all idle kernels"""
+        while self._idle_kernels:
+            self._idle_kernels.pop().shutdown()
+        for fd in self._output_fds:
+            if fd is not None:
+                os.close(fd)
+        self._output_fds = (None, None)
+
+
+# pool used by the current process
+_kernel_pool = None
+
+
+def get_kernel_pool():
+    """Get the kernel pool of the current process, creating it if needed.
+    The pool is shut down when the process exits, including worker
+    processes."""
+    global _kernel_pool
+    if _kernel_pool is None:
+        _kernel_pool = KernelPool()
+        # multiprocessing finalizers also run when worker processes exit,
+        # unlike atexit handlers
+        multiprocessing.util.Finalize(
+            _kernel_pool,
+            _kernel_pool.shutdown,
+            exitpriority=10,
+        )
+    return _kernel_pool
+
+
+def shutdown_kernel_pool():
+    """Stop the kernels of the current process"""
+    global _kernel_pool
+    if _kernel_pool is not None:
+        _kernel_pool.shutdown()
+        _kernel_pool = None
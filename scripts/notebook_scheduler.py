@@ -0,0 +1,219 @@
+# %% ######################################################################
+import os
+import json
+import math
+from scripts.output_files import write_if_changed
+
+# %% ######################################################################
+
+# notebook metadata key with the resources used by a notebook, which
+# takes precedence over scripts/notebook_resources.json, e.g.
+# "execution_resources": {"cores": 4, "memory_gb": 2}
+RESOURCES_METADATA_KEY = "execution_resources"
+
+DEFAULT_RESOURCES = {
+    "cores": 1,
+    "memory_gb": 1,
+}
+
+
+def load_resource_config(config_path):
+    """Load the declared resources of the notebooks that start their own
+    MPI or joblib workers, e.g. scripts/notebook_resources.json"""
+    config = {
+        "default": dict(DEFAULT_RESOURCES),
+        "notebooks": {},
+    }
+    if os.path.exists(config_path):
+        with open(config_path, "r") as f:
+            saved_config = json.load(f)
+        config["default"].update(saved_config.get("default", {}))
+        config["notebooks"].update(saved_config.get("notebooks", {}))
+    return config
+
+
+def get_notebook_resources(
+        filename,
+        notebook,
+        config,
+        ):
+    """
+    Get the cores and memory that executing a notebook uses.
+
+    Arguments
+    ---------
+    filename : str
+        File name of the notebook
+    notebook : nbformat.NotebookNode | None
+        The parsed notebook, whose metadata may declare its resources
+    config : dict
+        Declared resources, as loaded by load_resource_config
+
+    Returns
+    -------
+    resources : dict
+        Number of 'cores' and 'memory_gb' used by the notebook
+    """
+    resources = dict(config["default"])
+    resources.update(config["notebooks"].get(filename, {}))
+    if notebook is not None:
+        resources.update(notebook.metadata.get(RESOURCES_METADATA_KEY, {}))
+    return resources
+
+
+def get_machine_resources():
+    """Get the cores available to the build and the physical memory of the
+    machine, in GB; the memory is None if it cannot be determined"""
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+
+    try:
+        memory_gb = os.sysconf("SC_PHYS_PAGES") \
+            * os.sysconf("SC_PAGE_SIZE") / 1024**3
+    except (AttributeError, ValueError, OSError):
+        memory_gb = None
+
+    return {
+        "cores": cores,
+        "memory_gb": memory_gb,
+    }
+
+
+class NotebookDurations:
+    """
+    Execution times of notebooks measured by previous builds, used to
+    start the longest notebooks first. Notebooks are recorded by their
+    path relative to the site, and keep their last measured time.
+
+    Arguments
+    ---------
+    durations_path : str
+        Path to the .json file in which durations are saved
+    """
+
+    def __init__(self, durations_path):
+        self.durations_path = durations_path
+        self.durations = {}
+        try:
+            with open(durations_path, "r") as f:
+                self.durations = json.load(f)
+        except (OSError, ValueError):
+            # not saved yet, or left unreadable by an older build
+            pass
+
+    def get(self, nb_path):
+        """Get the last execution time of a notebook, or None if it was
+        never executed"""
+        return self.durations.get(os.path.relpath(nb_path))
+
+    def record(self, nb_path, duration):
+        """Record the execution time of a notebook"""
+        self.durations[os.path.relpath(nb_path)] = round(duration, 2)
+
+    def save(self):
+        """Save the recorded durations"""
+        write_if_changed(
+            self.durations_path,
+            json.dumps(self.durations, indent=4, sort_keys=True),
+            is_output=False,
+        )
+
+
+class ResourceScheduler:
+    """
+    Decide when notebooks can start, so that the notebooks running at
+    once do not use more cores or memory than the budget, e.g. because
+    several notebooks start their own MPI workers.
+
+    Notebooks are started longest expected execution time first, with
+    notebooks that were never executed before the others. When the next
+    notebook does not fit in the remaining budget, shorter notebooks that
+    do fit are started in the meantime. A notebook that needs more than
+    the whole budget is run alone.
+
+    Arguments
+    ---------
+    nb_paths : list of str
+        Paths to the notebooks to execute
+    resources : dict
+        Mapping of notebook paths to the 'cores' and 'memory_gb' they use
+    budget : dict
+        Total 'cores' and 'memory_gb' of the running notebooks; a budget
+        of None is not limited
+    max_running : int
+        Maximum number of notebooks running at once
+    expected_durations : dict | None
+        Mapping of notebook paths to their expected execution times
+    """
+
+    def __init__(
+            self,
+            nb_paths,
+            resources,
+            budget,
+            max_running,
+            expected_durations=None,
+            ):
+        self.resources = resources
+        self.budget = budget
+        self.max_running = max_running
+
+        expected_durations = expected_durations or {}
+
+        def sort_key(nb_path):
+            duration = expected_durations.get(nb_path)
+            return -(math.inf if duration is None else duration)
+
+        # sorted() is stable, so ties keep the order of nb_paths
+        self.pending = sorted(nb_paths, key=sort_key)
+        self.running = set()
+
+    def has_pending(self):
+        return bool(self.pending)
+
+    def _fits(self, nb_path):
+        for resource in ("cores", "memory_gb"):
+            if self.budget.get(resource) is None:
+                continue
+            used = sum(
+                self.resources[running_path][resource]
+                for running_path in self.running
+            )
+            if used + self.resources[nb_path][resource] > \
+                    self.budget[resource]:
+                return False
+        return True
+
+    def start_ready(self):
+        """
+        Get the notebooks that can start now, and mark them as running.
+
+        Returns
+        -------
+        nb_paths : list of str
+            Notebooks to start, in order
+        """
+        started = []
+        for nb_path in list(self.pending):
+            if len(self.running) >= self.max_running:
+                break
+            if self._fits(nb_path):
+                self.pending.remove(nb_path)
+                self.running.add(nb_path)
+                started.append(nb_path)
+
+        if self.pending and not self.running:
+            nb_path = self.pending.pop(0)
+            print(
+                f"Notebook '{os.path.basename(nb_path)}' needs more"
+                " resources than the budget allows; running it alone"
+            )
+            self.running.add(nb_path)
+            started.append(nb_path)
+        return started
+
+    def finish(self, nb_path):
+        """Release the resources of a notebook that finished"""
+        self.running.discard(nb_path)
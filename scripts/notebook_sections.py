@@ -0,0 +1,203 @@
+# %% ######################################################################
+import os
+import re
+import json
+import html
+
+# %% ######################################################################
+
+
+def normalize_title(title):
+    """Normalize a section title for matching: html tags and entities are
+    removed, whitespace is collapsed and letters are lowercased, so that
+    a title written in markdown matches the header converted by pandoc"""
+    title = html.unescape(re.sub(r"<[^>]+>", "", title))
+    return " ".join(title.split()).lower()
+
+
+# opening and closing tags of the divs wrapping notebook cells
+DIV_TAG_PATTERN = re.compile(r"<div\b[^>]*>|</div>")
+DIV_OPENING_PATTERN = re.compile(r"<div\b[^>]*>")
+HEADER_PATTERN = re.compile(r"<h[1-6]>(.*?)</h[1-6]>")
+
+
+class NotebookSections:
+    """
+    The sections of a notebook, as written to its .json output by
+    html_to_json, with an index of the section offsets by title.
+
+    Sections are stored in notebook order. Like structure_json, a section
+    contains the sections that follow it with a deeper header level, up
+    to the next section of the same or a higher level.
+
+    Arguments
+    ---------
+    nb_name : str
+        Jupyter notebook file name
+    nb_outputs : dict
+        Mapping of section titles to their 'level' and 'html'
+    """
+
+    def __init__(
+            self,
+            nb_name,
+            nb_outputs,
+            ):
+        self.nb_name = nb_name
+        self.titles = []
+        self.levels = []
+        self.html = []
+        for title, content in nb_outputs.items():
+            if isinstance(content, dict) and 'html' in content:
+                self.titles.append(title)
+                self.levels.append(content.get('level', 1))
+                self.html.append(content['html'])
+
+        # offset of each section by title; the first section wins when
+        # several sections share a title
+        self.offsets = {}
+        for offset, title in enumerate(self.titles):
+            self.offsets.setdefault(normalize_title(title), offset)
+
+        # offset after the last subsection of each section
+        self.section_ends = []
+        for offset, level in enumerate(self.levels):
+            end = offset + 1
+            while end < len(self.levels) and self.levels[end] > level:
+                end += 1
+            self.section_ends.append(end)
+
+        # html_to_json starts each section one line before its header, so
+        # the lines of all sections are indexed to cut ranges at the
+        # header lines instead
+        self.lines = []
+        self.header_lines = []
+        for title, section_html in zip(self.titles, self.html):
+            section_lines = section_html.split('\n')
+            header_line = 1
+            for i, line in enumerate(section_lines):
+                match = HEADER_PATTERN.match(line.strip())
+                if match and match.group(1).strip() == title:
+                    header_line = i
+                    break
+            self.header_lines.append(
+                len(self.lines) + min(header_line, len(section_lines) - 1)
+            )
+            self.lines += section_lines
+
+        # the divs that are open at each header line
+        self.open_divs = []
+        open_divs = []
+        header_lines = iter(self.header_lines + [None])
+        next_header = next(header_lines)
+        for i, line in enumerate(self.lines):
+            while next_header == i:
+                self.open_divs.append(list(open_divs))
+                next_header = next(header_lines)
+            for tag in DIV_TAG_PATTERN.findall(line):
+                if tag == '</div>':
+                    if open_divs:
+                        open_divs.pop()
+                else:
+                    open_divs.append(tag)
+
+    def get_offset(self, title):
+        """Get the offset of the section with the given title"""
+        offset = self.offsets.get(normalize_title(title))
+        if offset is None:
+            raise ValueError(
+                f"Section '{title}' not found in '{self.nb_name}'."
+                f" Available sections: {', '.join(self.titles)}"
+            )
+        return offset
+
+    def get_html(
+            self,
+            start=None,
+            end=None,
+            ):
+        """
+        Get the html of a range of sections.
+
+        Arguments
+        ---------
+        start : str | None
+            Title of the first section to include; defaults to the first
+            section of the notebook
+        end : str | None
+            Title of the last section to include, with its subsections.
+            If only start is given, the start section and its subsections
+            are included; if neither is given, the whole notebook is.
+
+        Returns
+        -------
+        agg_html : str
+        """
+        if start is None:
+            return ''.join(self.html)
+
+        first = self.get_offset(start)
+        end_offset = first if end is None else self.get_offset(end)
+        if end_offset < first:
+            raise ValueError(
+                f"Section '{end}' comes before section '{start}'"
+                f" in '{self.nb_name}'"
+            )
+        last = self.section_ends[end_offset]
+
+        first_line = self.header_lines[first]
+        if last < len(self.header_lines):
+            last_line = self.header_lines[last]
+            # leave out the opening tag of the cell of the next section
+            while last_line > first_line and \
+                    DIV_OPENING_PATTERN.fullmatch(
+                        self.lines[last_line-1].strip()
+                    ):
+                last_line -= 1
+        else:
+            last_line = len(self.lines)
+        range_lines = self.lines[first_line:last_line]
+
+        # reopen the cells that the range starts in, and close the cells
+        # that are still open where it ends
+        open_divs = len(self.open_divs[first])
+        for line in range_lines:
+            for tag in DIV_TAG_PATTERN.findall(line):
+                open_divs += -1 if tag == '</div>' else 1
+        return '\n'.join(
+            self.open_divs[first]
+            + range_lines
+            + ['</div>'] * max(open_divs, 0)
+        )
+
+
+class NotebookSectionStore:
+    """
+    In-memory cache of the parsed .json outputs of notebooks, so that a
+    notebook embedded in several pages, or several times in one page, is
+    read and indexed once per build. Entries are reloaded when the .json
+    file changes on disk.
+    """
+
+    def __init__(self):
+        self._notebooks = {}
+
+    def clear(self):
+        """Forget the notebooks loaded by the previous build"""
+        self._notebooks = {}
+
+    def get(
+            self,
+            nb_name,
+            json_path,
+            ):
+        """Get the NotebookSections of a notebook from its .json output"""
+        mtime = os.stat(json_path).st_mtime_ns
+        key = (json_path, nb_name)
+        cached = self._notebooks.get(key)
+        if cached is None or cached[0] != mtime:
+            with open(json_path, 'r') as file:
+                nb_outputs = json.load(file).get(nb_name, {})
+            cached = (mtime, NotebookSections(nb_name, nb_outputs))
+            self._notebooks[key] = cached
+        return cached[1]
@@ -0,0 +1,155 @@
+# %% ######################################################################
+import os
+import contextlib
+import tempfile
+
+# %% ######################################################################
+
+
+class OutputCounter:
+    """Count the output files written by a build, and the outputs that
+    were left untouched because their contents did not change"""
+
+    def __init__(self):
+        self.changed = 0
+        self.unchanged = 0
+
+    def record(self, changed):
+        """Record an output file that was or was not rewritten"""
+        if changed:
+            self.changed += 1
+        else:
+            self.unchanged += 1
+
+    def merge(self, counter):
+        """Add the counts of another counter, e.g. from a worker
+        process"""
+        self.changed += counter.changed
+        self.unchanged += counter.unchanged
+
+    def print_summary(self):
+        """Print the number of changed output files"""
+        print(
+            f"\nChanged {self.changed} output files"
+            f" ({self.unchanged} unchanged)"
+        )
+
+
+# counter used by the current process
+_output_counter = OutputCounter()
+
+
+def get_output_counter():
+    """Get the output counter used by the current process"""
+    return _output_counter
+
+
+@contextlib.contextmanager
+def count_outputs():
+    """Count the output files written by a block of code on a separate
+    counter, e.g. for a single rebuild in watch mode"""
+    global _output_counter
+
+    parent_counter = _output_counter
+    _output_counter = OutputCounter()
+    try:
+        yield _output_counter
+    finally:
+        _output_counter = parent_counter
+
+
+def write_atomic(
+        path,
+        content,
+        encoding="utf-8",
+        ):
+    """
+    Write a file through a temporary file in the same folder that is
+    renamed over it, so that an interrupted build never leaves a partially
+    written file, e.g. a corrupt cache or manifest.
+
+    Arguments
+    ---------
+    path : str
+        Path of the file
+    content : str | bytes
+        Contents to write; str contents are encoded with encoding
+    encoding : str
+        Encoding of str contents
+    """
+    if isinstance(content, str):
+        content = content.encode(encoding)
+
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(
+        dir=folder,
+        prefix=f".{os.path.basename(path)}.",
+        suffix=".tmp",
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        # keep the permissions of the file being replaced, since mkstemp
+        # creates files readable only by their owner
+        try:
+            os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+
+
+def write_if_changed(
+        path,
+        content,
+        encoding="utf-8",
+        is_output=True,
+        ):
+    """
+    Write a file unless it already has the given contents, so that
+    unchanged outputs keep their modification times and are not
+    re-uploaded by deploys or re-synced by static hosts.
+
+    The file is written with write_atomic, so that readers such as the
+    dev server never see a partially written file.
+
+    Arguments
+    ---------
+    path : str
+        Path of the output file
+    content : str | bytes
+        Contents to write; str contents are encoded with encoding
+    encoding : str
+        Encoding of str contents
+    is_output : bool
+        False for internal files of the build, e.g. caches, which are not
+        counted as outputs
+
+    Returns
+    -------
+    changed : bool
+        True if the file was written
+    """
+    if isinstance(content, str):
+        content = content.encode(encoding)
+
+    changed = True
+    try:
+        if os.path.getsize(path) == len(content):
+            with open(path, "rb") as f:
+                changed = f.read() != content
+    except OSError:
+        pass
+
+    if changed:
+        write_atomic(path, content)
+
+    if is_output:
+        _output_counter.record(changed)
+    return changed
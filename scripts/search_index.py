@@ -0,0 +1,199 @@
+# %% ######################################################################
+import os
+import re
+import json
+import hashlib
+from collections import Counter
+from html.parser import HTMLParser
+from scripts.output_files import write_if_changed
+
+# %% ######################################################################
+
+# number of leading characters of a term used to pick its index shard
+SHARD_PREFIX_LENGTH = 2
+
+# elements whose text is not searchable
+SKIPPED_ELEMENTS = {"script", "style", "math", "svg"}
+
+# words too common to be useful in queries; the same list is used by
+# content/assets/search.js
+STOP_WORDS = set("""
+a an and are as at be by can for from has have in is it its of on or
+that the this to was were which will with
+""".split())
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+class _TextExtractor(HTMLParser):
+    """Collect the text of an html document"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skipped_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_ELEMENTS:
+            self._skipped_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_ELEMENTS and self._skipped_depth:
+            self._skipped_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skipped_depth:
+            self.parts.append(data)
+
+
+def extract_text(html_text):
+    """Get the searchable text of rendered html, as a single line"""
+    extractor = _TextExtractor()
+    extractor.feed(html_text)
+    extractor.close()
+    return " ".join(" ".join(extractor.parts).split())
+
+
+def tokenize(text):
+    """Split text into lowercase search terms"""
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if len(token) > 1 and token not in STOP_WORDS
+    ]
+
+
+def get_shard_name(term):
+    """Get the name of the index shard that contains a term; prefixes
+    that are not plain ascii letters or digits are hex-encoded so that
+    shard file names are portable"""
+    prefix = term[:SHARD_PREFIX_LENGTH]
+    if re.fullmatch(r"[a-z0-9]+", prefix):
+        return prefix
+    return "x" + prefix.encode("utf-8").hex()
+
+
+def save_search_document(
+        document_path,
+        url,
+        title,
+        html_text,
+        ):
+    """
+    Extract and save the search terms of a rendered page, so that the
+    search index can be rebuilt without re-rendering unchanged pages.
+
+    Arguments
+    ---------
+    document_path : str
+        Path of the .json file to write
+    url : str
+        Site link of the page
+    title : str
+        Title of the page
+    html_text : str
+        Rendered body of the page, including spliced notebooks
+    """
+    text = extract_text(html_text)
+    terms = tokenize(text)
+    document = {
+        "url": url,
+        "title": title,
+        "summary": text[:200],
+        "length": len(terms),
+        "terms": dict(sorted(Counter(terms).items())),
+    }
+    # the documents are kept in the build cache, not published
+    write_if_changed(
+        document_path,
+        json.dumps(document, ensure_ascii=False),
+        is_output=False,
+    )
+
+
+def _write_json_if_changed(path, data):
+    return write_if_changed(
+        path,
+        json.dumps(data, ensure_ascii=False, separators=(",", ":")),
+    )
+
+
+def build_search_index(
+        document_paths,
+        index_folder,
+        ):
+    """
+    Build a sharded inverted index from saved search documents.
+
+    The index folder contains:
+      - meta.json, with the index version and the list of shards
+      - docs.json, with the url, title, summary and length of each page
+      - one <prefix>.json shard per term prefix, mapping each term to a
+        list of [document number, term count] postings
+
+    so that the browser only downloads the shards of the terms in a
+    query.
+
+    Arguments
+    ---------
+    document_paths : list of str
+        Saved search documents, in page order
+    index_folder : str
+        Folder to write the index to; stale shards are removed
+
+    Returns
+    -------
+    n_changed : int
+        Number of index files that were written
+    """
+    documents = []
+    postings = {}
+    for document_path in document_paths:
+        with open(document_path, "r", encoding="utf-8") as f:
+            document = json.load(f)
+        doc_id = len(documents)
+        documents.append([
+            document["url"],
+            document["title"],
+            document["summary"],
+            document["length"],
+        ])
+        for term, count in document["terms"].items():
+            postings.setdefault(term, []).append([doc_id, count])
+
+    shards = {}
+    for term in sorted(postings):
+        shards.setdefault(get_shard_name(term), {})[term] = postings[term]
+
+    os.makedirs(index_folder, exist_ok=True)
+    n_changed = _write_json_if_changed(
+        os.path.join(index_folder, "docs.json"),
+        documents,
+    )
+    for shard_name, shard in shards.items():
+        n_changed += _write_json_if_changed(
+            os.path.join(index_folder, f"{shard_name}.json"),
+            shard,
+        )
+
+    # the version changes whenever any part of the index changes, and is
+    # used by the browser to bypass cached shards
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps([documents, shards]).encode("utf-8"))
+    n_changed += _write_json_if_changed(
+        os.path.join(index_folder, "meta.json"),
+        {
+            "version": hasher.hexdigest()[:10],
+            "prefix_length": SHARD_PREFIX_LENGTH,
+            "shards": sorted(shards),
+        },
+    )
+
+    index_files = {"docs.json", "meta.json"} | {
+        f"{shard_name}.json" for shard_name in shards
+    }
+    for file_name in os.listdir(index_folder):
+        if file_name.endswith(".json") and file_name not in index_files:
+            os.remove(os.path.join(index_folder, file_name))
+
+    return n_changed
@@ -0,0 +1,98 @@
+# %% ######################################################################
+import os
+import re
+import json
+import hashlib
+from scripts.output_files import write_if_changed
+
+# %% ######################################################################
+
+# placeholder for the relative path from a page to the shared assets
+# folder, replaced when each page is rendered
+ASSETS_PATH_PLACEHOLDER = "__SHARED_ASSETS_PATH__"
+
+# inline <script> blocks without attributes
+INLINE_SCRIPT_PATTERN = re.compile(r"<script>\n?(.*?)</script>", re.DOTALL)
+
+# name of the shared navbar script, which is not fingerprinted (see
+# write_shared_assets)
+NAVBAR_ASSET_NAME = "navbar.js"
+
+
+def write_shared_assets(
+        html_parts,
+        assets_folder,
+        ):
+    """
+    Move the navbar and the inline scripts out of the page components
+    into shared .js files, so that browsers download them once instead of
+    with every page.
+
+    Each inline <script> block of the script template is written to a
+    fingerprinted script-<hash>.js file and replaced by a <script src>
+    tag at the same position, which preserves the execution order. The
+    navbar is written to navbar.js, which inserts the navbar html where
+    it is loaded. navbar.js keeps a fixed name, and is left out of the
+    fingerprinting of the --dist stage, so that changes to the page index
+    only change navbar.js instead of every page. It must therefore be
+    served with a short cache lifetime, e.g. the 10 minutes that GitHub
+    Pages uses for all files, rather than the long-lived caching of
+    fingerprinted assets.
+
+    Arguments
+    ---------
+    html_parts : dict
+        The page components from compile_page_components
+    assets_folder : str
+        Folder to write the shared assets to
+
+    Returns
+    -------
+    html_parts : dict
+        Copy of the page components, with the navbar and scripts
+        replaced by tags that load the shared assets. The tags contain
+        ASSETS_PATH_PLACEHOLDER, to be replaced with the relative path to
+        assets_folder for each page.
+    """
+    os.makedirs(assets_folder, exist_ok=True)
+    html_parts = html_parts.copy()
+
+    asset_names = []
+
+    def replace_script(match):
+        script = match.group(1)
+        digest = hashlib.sha256(script.encode("utf-8")).hexdigest()[:10]
+        asset_name = f"script-{digest}.js"
+        write_if_changed(os.path.join(assets_folder, asset_name), script)
+        asset_names.append(asset_name)
+        return (
+            f'<script src="{ASSETS_PATH_PLACEHOLDER}/{asset_name}">'
+            '</script>'
+        )
+
+    html_parts['script'] = INLINE_SCRIPT_PATTERN.sub(
+        replace_script,
+        html_parts['script'],
+    )
+
+    navbar_script = (
+        "document.currentScript.insertAdjacentHTML(\n"
+        f"    'beforebegin',\n    {json.dumps(html_parts['navbar'])}\n"
+        ");\n"
+    )
+    write_if_changed(
+        os.path.join(assets_folder, NAVBAR_ASSET_NAME),
+        navbar_script,
+    )
+    asset_names.append(NAVBAR_ASSET_NAME)
+    html_parts['navbar'] = (
+        f'\t<script src="{ASSETS_PATH_PLACEHOLDER}/{NAVBAR_ASSET_NAME}">'
+        '</script>'
+    )
+
+    # remove scripts left over from previous versions of the template
+    for file_name in os.listdir(assets_folder):
+        if file_name.endswith(".js") and file_name not in asset_names:
+            os.remove(os.path.join(assets_folder, file_name))
+
+    return html_parts
@@ -0,0 +1,103 @@
+# %% ######################################################################
+import os
+import json
+import time
+from scripts.output_files import write_if_changed
+
+# %% ######################################################################
+
+# files modified this recently are not cached, since a change made within
+# the resolution of the file system timestamps would not change their
+# modification time
+RACY_WINDOW_NS = 2 * 10**9
+
+
+def get_stat_signature(file_path):
+    """Get the size, modification time and inode of a file, which change
+    whenever the file is written, or replaced by another file (e.g. by
+    an atomic rename)"""
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+class StatCache:
+    """
+    Persistent cache of values computed from the contents of files, e.g.
+    hashes, keyed on the size, modification time and inode of each file.
+    Values of files whose stat data is unchanged are reused without
+    reading the files again.
+
+    Arguments
+    ---------
+    cache_path : str
+        Path to the .json file used to persist the cache
+    verify : bool
+        If True, cached values are never reused, so that every value is
+        computed from the file contents again; the recomputed values are
+        still recorded
+    """
+
+    def __init__(
+            self,
+            cache_path,
+            verify=False,
+            ):
+        self.cache_path = cache_path
+        self.verify = verify
+        self.entries = {}
+        try:
+            with open(cache_path, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            # not saved yet, or left unreadable by an older build
+            pass
+
+    def _key(self, file_path):
+        return os.path.relpath(file_path, os.getcwd())
+
+    def get(
+            self,
+            file_path,
+            name,
+            ):
+        """Get a value computed from a file, or None if the file changed
+        since the value was recorded"""
+        if self.verify:
+            return None
+        entry = self.entries.get(self._key(file_path))
+        if entry is None or \
+                entry["stat"] != get_stat_signature(file_path):
+            return None
+        return entry["values"].get(name)
+
+    def set(
+            self,
+            file_path,
+            name,
+            value,
+            ):
+        """Record a value computed from the current contents of a file"""
+        key = self._key(file_path)
+        stat = get_stat_signature(file_path)
+        if time.time_ns() - stat[1] < RACY_WINDOW_NS:
+            self.entries.pop(key, None)
+            return
+
+        entry = self.entries.get(key)
+        if entry is None or entry["stat"] != stat:
+            entry = {"stat": stat, "values": {}}
+            self.entries[key] = entry
+        entry["values"][name] = value
+
+    def save(self):
+        """Save the cache, dropping the entries of deleted files"""
+        entries = {
+            key: entry
+            for key, entry in sorted(self.entries.items())
+            if os.path.exists(key)
+        }
+        write_if_changed(
+            self.cache_path,
+            json.dumps(entries, indent=1),
+            is_output=False,
+        )
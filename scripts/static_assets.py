@@ -0,0 +1,312 @@
+# %% ######################################################################
+import os
+import re
+import gzip
+import hashlib
+import posixpath
+from scripts.content_model import SITE_URL_PREFIX
+from scripts.output_files import write_if_changed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# %% ######################################################################
+
+# static files that are renamed with a content hash so that they can be
+# cached by browsers indefinitely
+FINGERPRINT_EXTENSIONS = (
+    ".css",
+    ".js",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".svg",
+    ".webp",
+    ".ico",
+    ".woff",
+    ".woff2",
+)
+# text files for which precompressed .gz and .br siblings are written
+COMPRESS_EXTENSIONS = (".html", ".css", ".js", ".json", ".svg")
+
+# files and folders of the site root that are never published
+EXCLUDED_NAMES = ("__pycache__",)
+
+# src/href attributes in html and url() references in css
+HTML_REFERENCE_PATTERN = re.compile(
+    r"""(?P<prefix>\b(?:src|href)=)(?P<quote>["'])(?P<url>[^"']+)(?P=quote)"""
+)
+CSS_REFERENCE_PATTERN = re.compile(
+    r"""(?P<prefix>url\()(?P<quote>["']?)(?P<url>[^"')]+)(?P=quote)"""
+)
+
+
+def get_fingerprinted_name(file_name, content):
+    """Insert a hash of the file contents before the extension, e.g.
+    styles.css -> styles.3f2a9c1b7e.css"""
+    stem, extension = os.path.splitext(file_name)
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    # files that are already named by their contents are kept as is
+    if stem.endswith(digest):
+        return file_name
+    return f"{stem}.{digest}{extension}"
+
+
+def _compress(path, content):
+    """Write .gz and, if brotli is installed, .br siblings of a file when
+    they are smaller than the original"""
+    written = []
+    compressed = gzip.compress(content, compresslevel=9, mtime=0)
+    if len(compressed) < len(content):
+        write_if_changed(f"{path}.gz", compressed)
+        written.append(f"{path}.gz")
+    if brotli is not None:
+        compressed = brotli.compress(content)
+        if len(compressed) < len(content):
+            write_if_changed(f"{path}.br", compressed)
+            written.append(f"{path}.br")
+    return written
+
+
+class StaticSiteBuilder:
+    """
+    Copy the built site into a publish folder, with static assets renamed
+    to content-hashed (fingerprinted) file names, the references to them
+    rewritten in html and css files, and precompressed .gz and .br
+    siblings of text files.
+
+    Since a fingerprinted file name changes whenever the file changes,
+    the host can serve these files with a long-lived immutable
+    Cache-Control header. The original file names are also kept so that
+    links from outside the site keep working. Assets that must keep their
+    name, so that changing them does not change the pages that load
+    them, can be left out of the fingerprinting; they need a short cache
+    lifetime instead.
+
+    Arguments
+    ---------
+    site_path : str
+        Root folder of the built site
+    dist_path : str
+        Publish folder to write; files in it that are no longer part of
+        the site are removed
+    excluded_paths : list of str
+        Additional folders of the site root that are not published
+    unfingerprinted_paths : list of str
+        Assets that are published under their original name only
+    published_paths : list of str | None
+        Folders and files of the site root to publish, e.g. the content
+        folder, so that the build scripts and other files of the
+        repository are not deployed; the whole site root if None
+    """
+
+    def __init__(
+            self,
+            site_path,
+            dist_path,
+            excluded_paths=(),
+            unfingerprinted_paths=(),
+            published_paths=None,
+            ):
+        self.site_path = os.path.abspath(site_path)
+        self.published_paths = (
+            [self.site_path] if published_paths is None
+            else [os.path.abspath(path) for path in published_paths]
+        )
+        self.dist_path = os.path.abspath(dist_path)
+        self.excluded_paths = {
+            os.path.abspath(path) for path in excluded_paths
+        } | {self.dist_path}
+        self.unfingerprinted_paths = {
+            os.path.relpath(
+                os.path.abspath(path),
+                self.site_path,
+            ).replace(os.sep, "/")
+            for path in unfingerprinted_paths
+        }
+        # mapping of site-relative asset paths to fingerprinted paths
+        self.fingerprints = {}
+
+    def _find_files(self):
+        """Get the site-relative paths of the files to publish"""
+        def get_relative_path(file_path):
+            return os.path.relpath(
+                file_path,
+                self.site_path,
+            ).replace(os.sep, "/")
+
+        paths = []
+        for published_path in self.published_paths:
+            if os.path.isfile(published_path):
+                paths.append(get_relative_path(published_path))
+                continue
+            for root, folders, files in os.walk(published_path):
+                folders[:] = sorted(
+                    folder for folder in folders
+                    if not folder.startswith(".")
+                    and folder not in EXCLUDED_NAMES
+                    and os.path.join(root, folder) not in self.excluded_paths
+                )
+                for filename in sorted(files):
+                    if filename.startswith("."):
+                        continue
+                    paths.append(get_relative_path(
+                        os.path.join(root, filename)
+                    ))
+        return sorted(paths)
+
+    def _rewrite_url(self, url, relative_path):
+        """Get the fingerprinted url of an asset referenced from the file
+        at relative_path, or the url unchanged if it is not an asset"""
+        if re.match(r"^[a-zA-Z][a-zA-Z0-9+.-]*:|^//|^#", url):
+            return url
+
+        # keep any query string or fragment
+        path, separator, suffix = re.match(
+            r"([^?#]*)([?#]?)(.*)",
+            url,
+        ).groups()
+        if path.startswith(SITE_URL_PREFIX):
+            target = path[len(SITE_URL_PREFIX):]
+        elif path.startswith("/"):
+            return url
+        else:
+            target = posixpath.normpath(posixpath.join(
+                posixpath.dirname(relative_path),
+                path,
+            ))
+
+        fingerprinted = self.fingerprints.get(target)
+        if fingerprinted is None:
+            return url
+        new_path = posixpath.join(
+            posixpath.dirname(path),
+            posixpath.basename(fingerprinted),
+        )
+        return new_path + separator + suffix
+
+    def _rewrite_references(self, content, relative_path, pattern):
+        text = content.decode("utf-8")
+        text = pattern.sub(
+            lambda match: (
+                match.group("prefix")
+                + match.group("quote")
+                + self._rewrite_url(match.group("url"), relative_path)
+                + match.group("quote")
+            ),
+            text,
+        )
+        return text.encode("utf-8")
+
+    def build(self):
+        """
+        Write the publish folder.
+
+        Returns
+        -------
+        n_fingerprinted : int
+            Number of fingerprinted assets
+        n_changed : int
+            Number of files written to the publish folder
+        """
+        relative_paths = self._find_files()
+        output_paths = set()
+        n_changed = 0
+
+        def publish(relative_path, content):
+            nonlocal n_changed
+            dist_file = os.path.join(self.dist_path, relative_path)
+            n_changed += write_if_changed(dist_file, content)
+            output_paths.add(os.path.normpath(dist_file))
+            if relative_path.endswith(COMPRESS_EXTENSIONS):
+                for compressed_path in _compress(dist_file, content):
+                    output_paths.add(os.path.normpath(compressed_path))
+
+        def read(relative_path):
+            with open(os.path.join(self.site_path, relative_path), "rb") as f:
+                return f.read()
+
+        # fingerprint assets; css files may reference other assets, so
+        # they are rewritten after all other assets are fingerprinted
+        assets = [
+            path for path in relative_paths
+            if path.lower().endswith(FINGERPRINT_EXTENSIONS)
+            and path not in self.unfingerprinted_paths
+        ]
+        for relative_path in sorted(
+            assets,
+            key=lambda path: path.lower().endswith(".css"),
+        ):
+            content = read(relative_path)
+            if relative_path.lower().endswith(".css"):
+                content = self._rewrite_references(
+                    content,
+                    relative_path,
+                    CSS_REFERENCE_PATTERN,
+                )
+            fingerprinted = posixpath.join(
+                posixpath.dirname(relative_path),
+                get_fingerprinted_name(
+                    posixpath.basename(relative_path),
+                    content,
+                ),
+            )
+            self.fingerprints[relative_path] = fingerprinted
+            publish(fingerprinted, content)
+            publish(relative_path, content)
+
+        # copy the remaining files, pointing html pages to the
+        # fingerprinted assets
+        for relative_path in relative_paths:
+            if relative_path in self.fingerprints:
+                continue
+            content = read(relative_path)
+            if relative_path.endswith(".html"):
+                content = self._rewrite_references(
+                    content,
+                    relative_path,
+                    HTML_REFERENCE_PATTERN,
+                )
+            publish(relative_path, content)
+
+        # remove files left over from previous builds
+        for root, folders, files in os.walk(self.dist_path, topdown=False):
+            for filename in files:
+                file_path = os.path.normpath(os.path.join(root, filename))
+                if file_path not in output_paths:
+                    os.remove(file_path)
+            if root != self.dist_path and not os.listdir(root):
+                os.rmdir(root)
+
+        return len(self.fingerprints), n_changed
+
+
+def build_static_site(
+        site_path,
+        dist_path,
+        excluded_paths=(),
+        unfingerprinted_paths=(),
+        published_paths=None,
+        ):
+    """Write the fingerprinted and precompressed publish folder of the
+    site; see StaticSiteBuilder"""
+    builder = StaticSiteBuilder(
+        site_path,
+        dist_path,
+        excluded_paths,
+        unfingerprinted_paths,
+        published_paths,
+    )
+    n_fingerprinted, n_changed = builder.build()
+    print(
+        f"\nWrote {os.path.relpath(dist_path)} with {n_fingerprinted}"
+        f" fingerprinted assets ({n_changed} files changed)"
+    )
+    if brotli is None:
+        print(
+            "brotli is not installed; only .gz files were precompressed"
+        )
+    return builder